@@ -6,14 +6,19 @@ from typing import Dict, Any, List
 # Added error handling for imports
 try:
     import streamlit as st
-    from utils import (
-        load_config,
-        save_config,
-        fetch_available_models
+    from utils import get_available_models
+    from user_space import get_user_config_store
+    from ui import (
+        render_left_panel,
+        render_chat_center,
+        render_right_panel,
+        trim_session_messages,
+        RENDER_PAGE_SIZE,
+        SESSION_MESSAGE_LIMIT
     )
-    from ui import render_left_panel, render_chat_center, render_right_panel
-    from chat_utils import save_chat_history, get_chat_dates, load_chat_by_date
+    from chat_utils import save_chat_history, get_chat_dates, load_chat_window
     from custom_style import inject_chat_input_style
+    from response_cache import CACHE_ENABLED as RESPONSE_CACHE_ENABLED
 except ImportError as e:
     st.error(f"Failed to import a module: {e}")
 
@@ -48,11 +53,11 @@ def validate_selected_model(models: List[str]) -> None:
         st.session_state.selected_model = models[0]
 
 # Added type hints and validation for save_updated_state
-def save_updated_state(updated: bool, config: Dict[str, Any]) -> None:
+def save_updated_state(updated: bool) -> None:
     if not isinstance(updated, bool):
         raise ValueError("Updated must be a boolean.")
     if updated:
-        save_chat_history([{
+        st.session_state.chat_id = save_chat_history([{
             "model": st.session_state.selected_model,
             "meta": {
                 "temperature": st.session_state.temperature,
@@ -61,13 +66,14 @@ def save_updated_state(updated: bool, config: Dict[str, Any]) -> None:
                 "frequency_penalty": st.session_state.frequency_penalty,
                 "max_tokens": st.session_state.max_tokens,
             }
-        }] + st.session_state.messages)
+        }] + st.session_state.messages, st.session_state.get("chat_id"), st.session_state.get("history_offset", 0))
+        trim_session_messages()
 
-        config.update({
-            "last_selected_model": st.session_state.selected_model,
-            "api_key": st.session_state.api_key
-        })
-        save_config(config)
+        # Only the small settings are written; repeated values are skipped and bursts coalesced
+        get_user_config_store().update(
+            last_selected_model=st.session_state.selected_model,
+            api_key=st.session_state.api_key
+        )
 
 st.set_page_config(page_title="OpenRouter Chat", layout="wide")
 inject_chat_input_style()
@@ -75,10 +81,19 @@ inject_chat_input_style()
 st.markdown("<h1 style='margin-bottom:0'>OpenRouter Local Chat</h1>", unsafe_allow_html=True)
 st.caption("Chat with models via OpenRouter API")
 
-config = load_config()
-chat_dates = get_chat_dates()
-chat_history = load_chat_by_date(chat_dates[0]) if chat_dates else []
-restore_chat_metadata(chat_history, config)
+config = get_user_config_store().as_dict()
+
+# Restore the latest conversation once per session (only its newest messages are held in memory)
+if "chat_id" not in st.session_state:
+    chat_dates = get_chat_dates()
+    chat_id = chat_dates[0] if chat_dates else None
+    header, chat_history, history_offset = load_chat_window(chat_id, SESSION_MESSAGE_LIMIT) if chat_id else ({}, [], 0)
+    restore_chat_metadata(([header] if header else []) + chat_history, config)
+    st.session_state.update({
+        "messages": chat_history,
+        "chat_id": chat_id,
+        "history_offset": history_offset
+    })
 
 # Initialize session state with defaults
 defaults = {
@@ -89,13 +104,16 @@ defaults = {
     "presence_penalty": 0.0,
     "frequency_penalty": 0.0,
     "max_tokens": 2048,
-    "messages": chat_history,
-    "token_input": 0,
-    "token_output": 0,
-    "token_total": 0,
-    "cost_total": 0.0,
+    "messages": [],
+    "history_offset": 0,
+    "render_window": RENDER_PAGE_SIZE,
     "input_height": 80,
-    "custom_system_prompt": ""
+    "custom_system_prompt": "",
+    "stream_responses": True,
+    "context_policy": "drop-oldest",
+    "use_response_cache": RESPONSE_CACHE_ENABLED,
+    "last_pack_report": None,
+    "last_turn_stats": None
 }
 initialize_session_state(defaults)
 
@@ -103,7 +121,8 @@ if not st.session_state.api_key:
     st.error("API key is missing. Please provide a valid API key in the settings.")
     st.stop()
 
-models, multimodal, model_info = fetch_available_models(st.session_state.api_key)
+# Render from the cached catalog right away; a stale catalog is refreshed in the background
+models, multimodal, model_info = get_available_models(st.session_state.api_key)
 if not models:
     st.error("No models available or invalid API key. Please check credentials.")
     st.stop()
@@ -137,4 +156,4 @@ with r_col:
     render_right_panel(model_info=model_info)
 
 # Save updated state if changes occurred
-save_updated_state(updated, config)
+save_updated_state(updated)
@@ -1,14 +1,36 @@
+import argparse
+import hashlib
 import json
 import os
 import time
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from tqdm import tqdm
+from context_packer import pack_messages, describe_pack_report
+from model_catalog import get_cached_catalog
+from http_client import get_session
+from response_cache import response_cache, CACHE_ENABLED, CACHE_FORCE
+from result_store import ResultStore, format_report
+from token_utils import estimate_cost
+from preflight import estimate_scenario, get_failing_pairs, format_estimate, DEFAULT_COMPLETION_TOKENS
+from retry_policy import (
+    RetryPolicy, CircuitBreaker, CircuitOpenError, CIRCUIT_OPEN,
+    BREAKER_THRESHOLD, BREAKER_COOLDOWN, classify_error, parse_retry_after
+)
 
 API_KEY = ""
 API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 
-RETRY_COUNT = 3
 RESULTS_DIR = 'batch_results'
+RUNS_DIR = os.path.join(RESULTS_DIR, 'runs')
+
+# Execution limits (can be overridden per scenario via a "limits" block)
+MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+PER_MODEL_CONCURRENCY = int(os.getenv('BATCH_PER_MODEL_CONCURRENCY', '2'))
+REQUESTS_PER_SECOND = float(os.getenv('BATCH_REQUESTS_PER_SECOND', '2'))
+RATE_BURST = int(os.getenv('BATCH_RATE_BURST', '4'))
 
 
 def load_scenario(path):
@@ -22,27 +44,106 @@ def read_text_file(file_path):
     except Exception as e:
         return f"[Ошибка чтения файла {file_path}: {e}]"
 
-def send_request_to_api(model, system_prompt, user_prompt):
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json',
-    }
+def build_payload(model, messages, max_tokens=None, temperature=None):
     payload = {
         'model': model,
-        'messages': [
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': user_prompt}
-        ]
+        'messages': messages
+    }
+    if max_tokens:
+        payload['max_tokens'] = max_tokens
+    if temperature is not None:
+        payload['temperature'] = temperature
+    # Ask OpenRouter to include the billed cost in the usage block
+    payload['usage'] = {'include': True}
+    # Stream so time-to-first-token and generation speed can be measured
+    payload['stream'] = True
+    payload['stream_options'] = {'include_usage': True}
+    return payload
+
+# Error reported inside an SSE stream after the 200 response headers were sent
+class StreamError(Exception):
+    def __init__(self, error):
+        message = error.get('message', str(error)) if isinstance(error, dict) else str(error)
+        super().__init__(message)
+        code = error.get('code') if isinstance(error, dict) else None
+        self.status_code = code if isinstance(code, int) else 502
+
+def send_request_to_api(payload):
+    model = payload['model']
+    headers = {
+        'Content-Type': 'application/json',
     }
     try:
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
-        return response
+        return get_session(API_KEY).post(API_URL, headers=headers, json=payload, timeout=60, stream=payload.get('stream', False))
     except requests.exceptions.Timeout:
         print(f"[ERROR] Timeout while requesting model: {model}")
-        return None
+        raise
     except Exception as e:
         print(f"[ERROR] Exception while requesting model {model}: {e}")
-        return None
+        raise
+
+# Consume an SSE completion stream. Returns the body a non-streaming call would return
+# plus per-phase timings measured from t_send (when the request went out).
+def read_stream(response, t_send):
+    # Closed on every path, including a StreamError or a torn chunk, so the pooled connection is released
+    with response:
+        # SSE has no charset in its content type and requests would otherwise decode it as latin-1
+        response.encoding = 'utf-8'
+        headers_at = t_send + response.elapsed.total_seconds()
+        if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+            # The endpoint ignored `stream` and answered with a plain JSON body
+            body = response.json()
+            total = round(time.time() - t_send, 3)
+            return body, {
+                'headers_sec': round(headers_at - t_send, 3),
+                'ttft_sec': total,
+                'generation_sec': 0.0,
+                'total_sec': total,
+                'tokens_per_sec': None
+            }
+        first_token_at = None
+        content = []
+        usage = None
+        finish_reason = None
+        for line in response.iter_lines(decode_unicode=True):
+            # Skip blank separators and keep-alive comments such as ": OPENROUTER PROCESSING"
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            chunk = json.loads(data)
+            if chunk.get('error'):
+                raise StreamError(chunk['error'])
+            usage = chunk.get('usage') or usage
+            for choice in chunk.get('choices') or []:
+                finish_reason = choice.get('finish_reason') or finish_reason
+                delta = (choice.get('delta') or {}).get('content') or ''
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    content.append(delta)
+        end = time.time()
+
+        first_token_at = first_token_at or end
+        generation = end - first_token_at
+        # Fall back to the chunk count when the provider sends no usage block
+        usage = usage or {'completion_tokens': len(content)}
+        completion_tokens = usage.get('completion_tokens') or 0
+        body = {
+            'choices': [{'message': {'role': 'assistant', 'content': ''.join(content)}, 'finish_reason': finish_reason}],
+            'usage': usage
+        }
+        timings = {
+            'headers_sec': round(headers_at - t_send, 3),
+            'ttft_sec': round(first_token_at - t_send, 3),
+            'generation_sec': round(generation, 3),
+            'total_sec': round(end - t_send, 3),
+            # The first token arrives at first_token_at, so only the rest were generated in that window;
+            # with fewer than two content chunks there is no window to measure
+            'tokens_per_sec': round((completion_tokens - 1) / generation, 2) if len(content) > 1 and generation > 0 else None
+        }
+    return body, timings
 
 # Проверка доступности модели
 # def is_model_available(model):
@@ -63,71 +164,450 @@ def send_request_to_api(model, system_prompt, user_prompt):
 #     except Exception:
 #         return False
 
-def save_result(model, task_name, result_data):
-    os.makedirs(RESULTS_DIR, exist_ok=True)
-    model_safe = model.replace('/', '-').replace(':', '-')
-    now = datetime.now().strftime('%Y-%m-%d_%H-%M')
-    filename = f"{model_safe}__{task_name}__{now}.json"
-    with open(os.path.join(RESULTS_DIR, filename), 'w', encoding='utf-8') as f:
-        json.dump(result_data, f, ensure_ascii=False, indent=2)
-
-def main():
-    scenario = load_scenario('scenario.json')
-    for model in scenario['models']:
-        # print(f"[INFO] Checking model availability: {model}")
-        # if not is_model_available(model):
-        #     print(f"[ERROR] Model {model} is not available. Skipping.")
-        #     continue
-        for i, task in enumerate(scenario['tasks']):
-            attempt = 0
-            success = False
-            error_info = None
-            start_time = datetime.now().isoformat()
-            t0 = time.time()
-            # Используем только текстовые файлы для описания задания
-            attachment_path = task['attachments']['text']
-            task_file = os.path.basename(attachment_path)
-            task_name = os.path.splitext(task_file)[0]
-            file_content = read_text_file(attachment_path)
-            # Добавляем содержимое файла к user_prompt
-            user_prompt = f"{task['user_prompt']}\n\n[Описание задания из файла]:\n{file_content}"
-            while attempt < RETRY_COUNT and not success:
-                try:
-                    response = send_request_to_api(
-                        model,
-                        task['system_prompt'],
-                        user_prompt
-                    )
-                    if response is not None and response.status_code == 200:
-                        answer = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-                        success = True
-                    else:
-                        answer = None
-                        error_info = {
-                            'status_code': response.status_code if response is not None else None,
-                            'text': response.text if response is not None else None
-                        }
-                except Exception as e:
+def get_scenario_hash(scenario):
+    canonical = json.dumps({'models': scenario['models'], 'tasks': scenario['tasks']}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# Checkpoint of a batch run: per model×task status, persisted atomically after every change
+class RunManifest:
+    def __init__(self, data, path):
+        self.data = data
+        self.path = path
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, scenario_path, scenario_hash):
+        run_id = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        now = datetime.now().isoformat()
+        data = {
+            'run_id': run_id,
+            'scenario_path': scenario_path,
+            'scenario_hash': scenario_hash,
+            'created_at': now,
+            'updated_at': now,
+            'pairs': {}
+        }
+        manifest = cls(data, os.path.join(RUNS_DIR, f"{run_id}.json"))
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, run_id):
+        path = os.path.join(RUNS_DIR, f"{run_id}.json")
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), path)
+
+    # Most recent run of the same scenario, if any
+    @classmethod
+    def find_latest(cls, scenario_hash):
+        try:
+            run_files = sorted((f for f in os.listdir(RUNS_DIR) if f.endswith('.json')), reverse=True)
+        except FileNotFoundError:
+            return None
+        for run_file in run_files:
+            try:
+                manifest = cls.load(os.path.splitext(run_file)[0])
+            except (OSError, json.JSONDecodeError):
+                continue
+            if manifest.data.get('scenario_hash') == scenario_hash:
+                return manifest
+        return None
+
+    @property
+    def run_id(self):
+        return self.data['run_id']
+
+    def save(self):
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        return self.data['pairs'].get(key, {})
+
+    def update(self, key, **fields):
+        with self.lock:
+            pair = self.data['pairs'].setdefault(key, {'status': 'pending', 'attempts': 0})
+            pair.update(fields, updated_at=datetime.now().isoformat())
+            self.data['updated_at'] = pair['updated_at']
+            self.save()
+
+    # Record pending pairs in one write
+    def register(self, pairs):
+        with self.lock:
+            for key, (model, task_name) in pairs.items():
+                self.data['pairs'].setdefault(key, {'model': model, 'task': task_name, 'status': 'pending', 'attempts': 0})
+            self.save()
+
+    def is_done(self, key):
+        return self.get(key).get('status') == 'success'
+
+def get_pair_key(model, prepared):
+    return f"{model}|{prepared['index']}|{prepared['task_name']}"
+
+# Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`
+# A rate of 0 or below disables the limit
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        # A bucket smaller than one token would never let a request through
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_limits(scenario):
+    # Scenario-level "limits" override the module defaults
+    limits = scenario.get('limits', {})
+    return {
+        'max_concurrency': int(limits.get('max_concurrency', MAX_CONCURRENCY)),
+        'per_model_concurrency': int(limits.get('per_model_concurrency', PER_MODEL_CONCURRENCY)),
+        'model_concurrency': limits.get('model_concurrency', {}),
+        'requests_per_second': float(limits.get('requests_per_second', REQUESTS_PER_SECOND)),
+        'burst': int(limits.get('burst', RATE_BURST)),
+    }
+
+def prepare_task(index, task):
+    # Используем только текстовые файлы для описания задания
+    attachment_path = task['attachments']['text']
+    task_file = os.path.basename(attachment_path)
+    file_content = read_text_file(attachment_path)
+    return {
+        'index': index,
+        'task': task,
+        'task_name': os.path.splitext(task_file)[0],
+        'attachment_path': attachment_path,
+        'file_content': file_content,
+    }
+
+# Build the request messages, fitting the attachment into the model's context window.
+# Models missing from the cached catalog get the full prompt unchanged.
+def build_messages(model, prepared, max_tokens=None):
+    task = prepared['task']
+    context_length = (get_cached_catalog() or {}).get('model_info', {}).get(model, {}).get('context_length')
+    if not context_length:
+        # Добавляем содержимое файла к user_prompt
+        user_prompt = f"{task['user_prompt']}\n\n[Описание задания из файла]:\n{prepared['file_content']}"
+        return [
+            {'role': 'system', 'content': task['system_prompt']},
+            {'role': 'user', 'content': user_prompt}
+        ], None
+    return pack_messages(
+        task['system_prompt'],
+        [{'role': 'user', 'content': task['user_prompt']}],
+        context_length=context_length,
+        # Reserve the same completion budget the preflight estimate assumed
+        max_tokens=max_tokens or DEFAULT_COMPLETION_TOKENS,
+        attachment_text=prepared['file_content'],
+        attachment_header='[Описание задания из файла]'
+    )
+
+def run_task(model, prepared, ctx):
+    task = prepared['task']
+    max_tokens = ctx['max_tokens']
+    manifest = ctx['manifest']
+    store = ctx['store']
+    pair_key = get_pair_key(model, prepared)
+    messages, pack_report = build_messages(model, prepared, max_tokens)
+    user_prompt = messages[-1]['content']
+    if pack_report and describe_pack_report(pack_report):
+        print(f"[WARN] {model} / {prepared['task_name']}: {describe_pack_report(pack_report)}")
+    attempt = 0
+    success = False
+    error_info = None
+    previous_attempts = manifest.get(pair_key).get('attempts', 0)
+    payload = build_payload(model, messages, max_tokens, ctx['temperature'])
+    record = {
+        'run_id': manifest.run_id,
+        'model': model,
+        'task': prepared['task_name'],
+        'task_index': prepared['index'],
+        'system_prompt': task['system_prompt'],
+        'user_prompt': user_prompt,
+        'attachment_path': prepared['attachment_path'],
+        'context_report': pack_report,
+    }
+
+    # Identical requests are answered from the response cache without a network call
+    cached = response_cache.get(payload, **ctx['cache'])
+    if cached is not None:
+        result_id = store.record_attempt(
+            **record,
+            attempt=previous_attempts,
+            status='success',
+            answer=cached.get('choices', [{}])[0].get('message', {}).get('content', ''),
+            latency_sec=0.0,
+            elapsed_sec=0.0,
+            cached=True
+        )
+        manifest.update(
+            pair_key, model=model, task=prepared['task_name'], status='success',
+            attempts=previous_attempts, result_id=result_id
+        )
+        return True
+
+    policy = ctx['retry_policy']
+    breaker = ctx['breakers'][model]
+    model_meta = (get_cached_catalog() or {}).get('model_info', {}).get(model, {})
+    with ctx['model_slots'][model]:
+        t0 = time.time()
+        manifest.update(pair_key, model=model, task=prepared['task_name'], status='running')
+        while attempt < policy.max_attempts and not success:
+            kind = None
+            retry_after = None
+            latency = None
+            usage = None
+            timings = None
+            # The first attempt waited in the worker pool and for a model slot; retries only for the rate limiter
+            t_ready = ctx['submitted_at'] if attempt == 0 else time.time()
+            try:
+                # A model whose circuit is open fails fast instead of occupying a worker
+                if not breaker.allow():
+                    raise CircuitOpenError(model, breaker.retry_in())
+                ctx['limiter'].acquire()
+                t_send = time.time()
+                response = send_request_to_api(payload)
+                latency = round(time.time() - t_send, 3)
+                if response.status_code == 200:
+                    body, timings = read_stream(response, t_send)
+                    timings['queue_wait_sec'] = round(t_send - t_ready, 3)
+                    latency = timings['total_sec']
+                    answer = body.get('choices', [{}])[0].get('message', {}).get('content', '')
+                    usage = body.get('usage') or {}
+                    success = True
+                    breaker.record_success()
+                    response_cache.put(payload, body, **ctx['cache'])
+                else:
                     answer = None
-                    error_info = {'exception': str(e)}
-                finally:
-                    # Сохраняем результат даже если программа была прервана или возникла ошибка
-                    duration = round(time.time() - t0, 3)
-                    result = {
-                        'model': model,
-                        'system_prompt': task['system_prompt'],
-                        'user_prompt': user_prompt,
-                        'attachments': [attachment_path],
-                        'answer': answer,
-                        'error': error_info if not success else None,
-                        'timestamp': start_time,
-                        'duration_sec': duration,
-                        'attempts': attempt + 1
+                    kind = classify_error(status_code=response.status_code)
+                    retry_after = parse_retry_after(response.headers)
+                    error_info = {
+                        'kind': kind,
+                        'status_code': response.status_code,
+                        'text': response.text
                     }
-                    save_result(model, task_name, result)
-                if not success:
-                    time.sleep(5)  # Задержка между попытками
-            time.sleep(5)  # Задержка между задачами для одной модели
+            except Exception as e:
+                answer = None
+                kind = classify_error(exception=e)
+                error_info = {'kind': kind, 'exception': str(e)}
+            finally:
+                # Сохраняем результат даже если программа была прервана или возникла ошибка
+                # A request refused by the open circuit never reached the API
+                attempts_made = attempt + (0 if kind == CIRCUIT_OPEN else 1)
+                cost = None
+                if usage and usage.get('cost') is None:
+                    cost = estimate_cost(model_meta, usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0)
+                result_id = store.record_attempt(
+                    **record,
+                    attempt=previous_attempts + attempts_made,
+                    status='success' if success else 'failed',
+                    answer=answer,
+                    error=error_info if not success else None,
+                    latency_sec=latency,
+                    elapsed_sec=round(time.time() - t0, 3),
+                    usage=usage,
+                    cost=cost,
+                    timings=timings
+                )
+                manifest.update(
+                    pair_key,
+                    status='success' if success else 'failed',
+                    attempts=previous_attempts + attempts_made,
+                    result_id=result_id
+                )
+            attempt += 1
+            if success or kind == CIRCUIT_OPEN:
+                break
+            breaker.record_failure(kind)
+            # Permanent errors (bad request, auth, unknown model) are not retried
+            if not policy.should_retry(kind, attempt):
+                break
+            time.sleep(policy.get_delay(attempt, retry_after))
+    return success
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run a batch scenario against OpenRouter models.')
+    parser.add_argument('--scenario', default='scenario.json', help='Path to the scenario JSON file')
+    parser.add_argument(
+        '--resume', nargs='?', const='latest', metavar='RUN_ID',
+        help='Resume a previous run (default: the latest run of this scenario), skipping completed pairs'
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        '--cache', dest='cache', action='store_true', default=CACHE_ENABLED,
+        help='Reuse cached responses for identical requests (temperature 0 only unless --force-cache)'
+    )
+    cache_group.add_argument('--no-cache', dest='cache', action='store_false', help='Bypass the response cache')
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Estimate cost and context fit of every model×task pair from the cached catalog without sending requests'
+    )
+    parser.add_argument(
+        '--report', nargs='?', const='latest', metavar='RUN_ID',
+        help='Print latency, success rate, attempts and cost per model and task for a run (default: latest) and exit'
+    )
+    parser.add_argument(
+        '--force-cache', action='store_true', default=CACHE_FORCE,
+        help='Also cache requests with non-zero or unset temperature'
+    )
+    return parser.parse_args(argv)
+
+# Open the manifest to resume, or start a new run
+def open_manifest(args, scenario_hash):
+    if args.resume == 'latest':
+        manifest = RunManifest.find_latest(scenario_hash)
+        if manifest is None:
+            print('[INFO] No previous run of this scenario found. Starting a new run.')
+            return RunManifest.create(args.scenario, scenario_hash)
+        return manifest
+    if args.resume:
+        manifest = RunManifest.load(args.resume)
+        if manifest.data.get('scenario_hash') != scenario_hash:
+            raise SystemExit(f"[ERROR] Run {args.resume} was created from a different scenario.")
+        return manifest
+    return RunManifest.create(args.scenario, scenario_hash)
+
+# Estimate cost and context fit for the whole scenario from the cached catalog (no network calls).
+# Returns the estimate and the pair keys that will certainly fail.
+def run_preflight(scenario, prepared_tasks):
+    catalog = get_cached_catalog()
+    estimate = estimate_scenario(
+        scenario['models'],
+        [
+            {
+                'system_prompt': prepared['task']['system_prompt'],
+                'user_prompt': prepared['task']['user_prompt'],
+                'attachment_text': prepared['file_content'],
+            }
+            for prepared in prepared_tasks
+        ],
+        catalog['model_info'] if catalog else None,
+        scenario.get('max_tokens')
+    )
+    failing = {
+        get_pair_key(scenario['models'][m], prepared_tasks[t])
+        for m, t in get_failing_pairs(estimate)
+    }
+    return estimate, failing
+
+# Aggregated report for a run from the result store
+def print_report(store, run_id):
+    if run_id == 'latest':
+        run_id = store.get_latest_run()
+    if not run_id:
+        print('[INFO] No runs recorded yet.')
+        return
+    print(f"Run {run_id}\n")
+    for by in ('model', 'task'):
+        rows = store.aggregate(run_id, by=by)
+        if not rows:
+            print(f"[INFO] No attempts recorded for run {run_id}.")
+            return
+        print(format_report(rows, by=by))
+        print()
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.report:
+        print_report(ResultStore(), args.report)
+        return
+
+    scenario = load_scenario(args.scenario)
+    # Attachments are read once here and reused for the estimate and every request
+    prepared_tasks = [prepare_task(i, task) for i, task in enumerate(scenario['tasks'])]
+    estimate, failing = run_preflight(scenario, prepared_tasks)
+    if args.dry_run:
+        if get_cached_catalog() is None:
+            print('[WARN] No cached model catalog: costs and context fit are unknown. Open the UI or refresh models first.')
+        print(format_estimate(estimate, [prepared['task_name'] for prepared in prepared_tasks]))
+        return
+
+    # Opened only for real runs: a dry run must not create the results database
+    store = ResultStore()
+    scenario_hash = get_scenario_hash(scenario)
+    manifest = open_manifest(args, scenario_hash)
+    store.register_run(manifest.run_id, args.scenario, scenario_hash)
+    print(f"[INFO] Run {manifest.run_id} (manifest: {manifest.path}, results: {store.path})")
+
+    limits = get_limits(scenario)
+    # Scenario-level "retry" block overrides the retry policy defaults
+    retry = scenario.get('retry', {})
+    ctx = {
+        'limiter': TokenBucket(limits['requests_per_second'], limits['burst']),
+        'model_slots': {
+            model: threading.BoundedSemaphore(int(limits['model_concurrency'].get(model, limits['per_model_concurrency'])))
+            for model in scenario['models']
+        },
+        'manifest': manifest,
+        'store': store,
+        'max_tokens': scenario.get('max_tokens'),
+        'temperature': scenario.get('temperature'),
+        'cache': {'force': args.force_cache, 'bypass': not args.cache},
+        'retry_policy': RetryPolicy.from_config(retry),
+        'breakers': {
+            model: CircuitBreaker(
+                model,
+                threshold=int(retry.get('breaker_threshold', BREAKER_THRESHOLD)),
+                cooldown=float(retry.get('breaker_cooldown', BREAKER_COOLDOWN))
+            )
+            for model in scenario['models']
+        },
+    }
+
+    # Pairs that will certainly fail (unknown model, prompt larger than the context) are not sent
+    for model, prepared in ((model, prepared) for prepared in prepared_tasks for model in scenario['models']):
+        key = get_pair_key(model, prepared)
+        if key in failing and not manifest.is_done(key):
+            manifest.update(key, model=model, task=prepared['task_name'], status='skipped', reason='preflight: cannot fit or unknown model')
+    if failing:
+        print(f"[WARN] Skipping {len(failing)} pairs that cannot succeed (see --dry-run)")
+
+    # Interleave models so every model makes progress in parallel
+    pairs = [
+        (model, prepared) for prepared in prepared_tasks for model in scenario['models']
+        if not manifest.is_done(get_pair_key(model, prepared)) and get_pair_key(model, prepared) not in failing
+    ]
+    skipped = sum(
+        manifest.is_done(get_pair_key(model, prepared)) for prepared in prepared_tasks for model in scenario['models']
+    )
+    if skipped:
+        print(f"[INFO] Skipping {skipped} completed pairs")
+    manifest.register({get_pair_key(model, prepared): (model, prepared['task_name']) for model, prepared in pairs})
+
+    ctx['submitted_at'] = time.time()
+    with ThreadPoolExecutor(max_workers=limits['max_concurrency']) as executor:
+        futures = {
+            executor.submit(run_task, model, prepared, ctx): (model, prepared['task_name'])
+            for model, prepared in pairs
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Batch'):
+            model, task_name = futures[future]
+            try:
+                if not future.result():
+                    print(f"[ERROR] {model} failed on {task_name}")
+            except Exception as e:
+                print(f"[ERROR] {model} crashed on {task_name}: {e}")
+
+    if args.cache:
+        stats = response_cache.stats()
+        print(f"[INFO] Response cache: {stats['hits']} hits, {stats['misses']} misses")
+    print(f"[INFO] Summary: python batch_tester.py --report {manifest.run_id}")
 
 if __name__ == '__main__':
     main()
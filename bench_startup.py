@@ -0,0 +1,172 @@
+# bench_startup.py
+#
+# Cold-start benchmark: import time of the app's modules and time to the first complete script run.
+# Every measurement runs in a fresh interpreter inside a seeded temp directory. Exits with status 1
+# when a budget is exceeded or a deferred dependency is imported at startup, so it can gate changes:
+#
+#     python bench_startup.py --runs 5 --max-import-ms 800 --max-first-run-ms 3000
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+# Modules imported by `streamlit run app.py` before the first paint
+STARTUP_MODULES = ["app_imports", "ui", "utils", "chat_utils", "model_catalog", "config_store", "user_space"]
+# Heavy dependencies that must only load on first use (sending, uploads, retrieval)
+DEFERRED_MODULES = ["openai", "httpx", "requests", "numpy", "PIL", "PyPDF2", "docx"]
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Probes run in a fresh temp directory seeded with these files, so the app never fetches /models
+# and never touches the real config.json, chat_history/ or caches
+BENCH_MODELS = ["bench/text-model", "bench/vision-model"]
+# Environment overrides that would point the app outside the temp directory
+SANDBOX_UNSET = [
+    "CONFIG_FILE", "MODEL_CATALOG_FILE", "MODEL_CATALOG_TTL", "USER_DATA_DIR",
+    "FILE_CACHE_DIR", "RESPONSE_CACHE_DIR", "BATCH_RESULTS_DB"
+]
+
+# Imports everything app.py imports without running the page itself
+APP_IMPORTS = "import ui, utils, chat_utils, user_space, custom_style, response_cache"
+
+IMPORT_PROBE = """
+import sys, json, time
+sys.path.insert(0, {app_dir!r})
+t0 = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+FIRST_RUN_PROBE = """
+import sys, json, time
+sys.path.insert(0, {app_dir!r})
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app_path!r}, default_timeout=60)
+at.run()
+elapsed = time.perf_counter() - t0
+print(json.dumps({{
+    "ms": elapsed * 1000,
+    "loaded": [m for m in {deferred!r} if m in sys.modules],
+    "errors": [str(e.value) for e in at.exception]
+}}))
+"""
+
+
+# Write a placeholder API key and a fresh catalog snapshot, as a returning user would have them
+def seed_workdir(path: str) -> None:
+    base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    model_info = {
+        model: {"id": model, "context_length": 128000, "pricing": {"prompt": "0", "completion": "0"}}
+        for model in BENCH_MODELS
+    }
+    snapshot = {
+        "base_url": base_url,
+        "models": BENCH_MODELS,
+        "multimodal": [model for model in BENCH_MODELS if "vision" in model],
+        "model_info": model_info,
+        "etag": "",
+        "last_modified": "",
+        "content_hash": "",
+        "fetched_at": time.time()
+    }
+    with open(os.path.join(path, "model_catalog.json"), "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    with open(os.path.join(path, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"api_key": "bench-placeholder", "last_selected_model": BENCH_MODELS[0]}, f)
+
+
+def run_probe(code: str) -> Dict[str, Any]:
+    env = {k: v for k, v in os.environ.items() if k not in SANDBOX_UNSET}
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        seed_workdir(workdir)
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"Probe failed:\n{result.stderr.strip()[-2000:]}")
+    return json.loads(lines[-1])
+
+
+# Median import time of a module (or statement) over fresh interpreters
+def bench_import(name: str, runs: int) -> Dict[str, Any]:
+    statement = APP_IMPORTS if name == "app_imports" else f"import {name}"
+    samples = [
+        run_probe(IMPORT_PROBE.format(app_dir=APP_DIR, statement=statement, deferred=DEFERRED_MODULES))
+        for _ in range(runs)
+    ]
+    return {
+        "name": name,
+        "ms": statistics.median(s["ms"] for s in samples),
+        "loaded": sorted(set().union(*(s["loaded"] for s in samples)))
+    }
+
+
+# Median time from a cold interpreter to the end of the first script run of app.py
+def bench_first_run(runs: int) -> Dict[str, Any]:
+    samples = [
+        run_probe(FIRST_RUN_PROBE.format(app_dir=APP_DIR, app_path=os.path.join(APP_DIR, "app.py"), deferred=DEFERRED_MODULES))
+        for _ in range(runs)
+    ]
+    return {
+        "name": "first script run",
+        "ms": statistics.median(s["ms"] for s in samples),
+        "loaded": sorted(set().union(*(s["loaded"] for s in samples))),
+        "errors": sorted(set().union(*(s["errors"] for s in samples)))
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's import time and cold start.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if importing the app's modules takes longer")
+    parser.add_argument("--max-first-run-ms", type=float, default=None, help="Fail if the first script run takes longer")
+    parser.add_argument("--skip-first-run", action="store_true", help="Only measure imports")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results: List[Dict[str, Any]] = [bench_import(name, args.runs) for name in STARTUP_MODULES]
+    if not args.skip_first_run:
+        results.append(bench_first_run(args.runs))
+
+    failures = []
+    for result in results:
+        if result["loaded"]:
+            failures.append(f"{result['name']} imports deferred modules: {', '.join(result['loaded'])}")
+        if result.get("errors"):
+            failures.append(f"{result['name']} raised: {'; '.join(result['errors'])}")
+    app_imports = results[0]
+    if args.max_import_ms is not None and app_imports["ms"] > args.max_import_ms:
+        failures.append(f"app imports took {app_imports['ms']:.0f} ms (budget {args.max_import_ms:.0f} ms)")
+    if not args.skip_first_run and args.max_first_run_ms is not None and results[-1]["ms"] > args.max_first_run_ms:
+        failures.append(f"first script run took {results[-1]['ms']:.0f} ms (budget {args.max_first_run_ms:.0f} ms)")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        width = max(len(result["name"]) for result in results)
+        for result in results:
+            loaded = f"  loads {', '.join(result['loaded'])}" if result["loaded"] else ""
+            print(f"{result['name'].ljust(width)}  {result['ms']:8.1f} ms{loaded}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# chat_search.py
+
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List
+
+from token_utils import get_content_text
+
+# Hits returned per search
+SEARCH_LIMIT = 20
+# Words of context around the match in a snippet
+SNIPPET_WORDS = 12
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(
+    chat_id UNINDEXED,
+    position UNINDEXED,
+    role UNINDEXED,
+    content,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+-- What has been indexed per chat, to catch chats saved before the index existed or changed out of band
+CREATE TABLE IF NOT EXISTS indexed_chats (
+    chat_id TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+
+# Turn free text into an FTS5 query: every word must match, the last one as a prefix (search as you type)
+def build_match_query(text: str) -> str:
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+# Full-text index over saved chat messages, kept in step by the chat save/delete paths.
+# Safe to share between Streamlit sessions (threads).
+class ChatSearchIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # Index messages appended to a chat, starting at message `position`.
+    # `reset` drops what was indexed for the chat first (the conversation was rewritten).
+    def add_messages(self, chat_id: str, position: int, messages: List[Dict[str, Any]], message_count: int, size: int, reset: bool = False) -> None:
+        rows = [
+            (chat_id, position + i, m.get("role", ""), get_content_text(m.get("content", "")))
+            for i, m in enumerate(messages) if isinstance(m, dict)
+        ]
+        with self._lock, self._conn:
+            if reset:
+                self._conn.execute("DELETE FROM message_text WHERE chat_id = ?", (chat_id,))
+            self._conn.executemany("INSERT INTO message_text (chat_id, position, role, content) VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO indexed_chats (chat_id, message_count, size) VALUES (?, ?, ?)",
+                (chat_id, message_count, size)
+            )
+
+    # Indexed (message_count, size) of a chat, or None if it was never indexed
+    def get_state(self, chat_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT message_count, size FROM indexed_chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return (row["message_count"], row["size"]) if row else None
+
+    def remove_chat(self, chat_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM message_text WHERE chat_id = ?", (chat_id,))
+            self._conn.execute("DELETE FROM indexed_chats WHERE chat_id = ?", (chat_id,))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM message_text")
+            self._conn.execute("DELETE FROM indexed_chats")
+
+    # Chats whose indexed state differs from the chat index (chat_id -> (message_count, size)).
+    # Chats that no longer exist are dropped from the search index here.
+    def get_stale_chats(self, chats: Dict[str, tuple]) -> List[str]:
+        with self._lock:
+            indexed = {
+                row["chat_id"]: (row["message_count"], row["size"])
+                for row in self._conn.execute("SELECT chat_id, message_count, size FROM indexed_chats")
+            }
+        for chat_id in set(indexed) - set(chats):
+            self.remove_chat(chat_id)
+        return [chat_id for chat_id, state in chats.items() if indexed.get(chat_id) != tuple(state)]
+
+    # Best-matching messages first: chat_id, position, role and a snippet with matches in bold
+    def search(self, text: str, limit: int = SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        query = build_match_query(text)
+        if not query:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT chat_id, position, role,
+                       snippet(message_text, 3, '**', '**', '…', {SNIPPET_WORDS}) AS snippet
+                   FROM message_text WHERE message_text MATCH ?
+                   ORDER BY bm25(message_text) LIMIT ?""",
+                (query, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
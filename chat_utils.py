@@ -2,32 +2,307 @@
 
 import os
 import json
+import hashlib
+import sqlite3
 from datetime import datetime
+import threading
+from collections import OrderedDict
 import streamlit as st
+from chat_search import ChatSearchIndex, SEARCH_LIMIT
+from config_store import file_lock
+from user_space import get_current_user, get_user_chat_dir
 
+# Chats of the local (default) user; other users get USER_DATA_DIR/<user>/chat_history
 CHAT_DIR = "chat_history"
+# Conversations are append-only JSONL logs; plain .json files are legacy whole-file snapshots
+CHAT_EXT = ".jsonl"
+LEGACY_EXT = ".json"
+# Manifest with header metadata for every saved chat (dotfile so it is never listed as a chat)
+INDEX_FILE_NAME = ".index.json"
+TITLE_LENGTH = 60
+# Rewrite a conversation log once it carries this many superseded records
+COMPACT_MIN_DEAD_RECORDS = 50
+# Full-text search index over saved messages (dotfile so it is never listed as a chat)
+SEARCH_DB_NAME = ".search.db"
+# Parsed conversation logs kept in memory for paging
+CHAT_CACHE_SIZE = 8
+
+# In-process copies of each chat directory's index, reused while the directory is unchanged
+_index_caches = {}
+_index_caches_lock = threading.Lock()
+# Search index per chat directory, opened on first use
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+# path -> ((size, mtime), header, messages); an append or rewrite changes the key, so stale entries are never served
+_chat_cache = OrderedDict()
+_chat_cache_lock = threading.Lock()
+
+# Chat directory of the current session's user
+def get_chat_dir() -> str:
+    return get_user_chat_dir(get_current_user(), CHAT_DIR)
+
+def _copy_chats(chats: dict) -> dict:
+    return {chat_id: dict(entry) for chat_id, entry in chats.items()}
+
+# Cached index of a chat directory if it is still current; callers get their own copy to modify
+def _get_cached_index(chat_dir: str, dir_mtime: int):
+    with _index_caches_lock:
+        cached = _index_caches.get(chat_dir)
+        if cached is None or cached["chats"] is None or cached["dir_mtime"] != dir_mtime:
+            return None
+        return _copy_chats(cached["chats"])
+
+def _set_cached_index(chat_dir: str, dir_mtime, chats) -> None:
+    with _index_caches_lock:
+        _index_caches[chat_dir] = {"dir_mtime": dir_mtime, "chats": _copy_chats(chats) if chats is not None else None}
 
 # Ensure chat directory exists
 def ensure_chat_directory_exists() -> None:
-    os.makedirs(CHAT_DIR, exist_ok=True)
+    os.makedirs(get_chat_dir(), exist_ok=True)
 
 def ensure_directory_exists(directory: str) -> None:
     os.makedirs(directory, exist_ok=True)
 
+def get_chat_path(chat_id: str) -> str:
+    return os.path.join(get_chat_dir(), f"{chat_id}{CHAT_EXT}")
+
+def get_legacy_chat_path(chat_id: str) -> str:
+    return os.path.join(get_chat_dir(), f"{chat_id}{LEGACY_EXT}")
+
+# Stable ID for a new conversation (creation timestamp, unique within the chat directory)
+def new_chat_id() -> str:
+    base = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    chat_id = base
+    suffix = 2
+    while os.path.exists(get_chat_path(chat_id)) or os.path.exists(get_legacy_chat_path(chat_id)):
+        chat_id = f"{base}_{suffix}"
+        suffix += 1
+    return chat_id
+
 # Get available chat dates
 def get_chat_dates() -> list:
+    return [entry["date"] for entry in list_chats()]
+
+# Extract a short title from the first user message
+def get_chat_title(messages: list) -> str:
+    for m in messages:
+        if not isinstance(m, dict) or m.get("role") != "user":
+            continue
+        content = m.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        title = " ".join(str(content).split())
+        return title[:TITLE_LENGTH] + ("…" if len(title) > TITLE_LENGTH else "")
+    return ""
+
+def get_header_hash(header: dict) -> str:
+    return hashlib.sha1(json.dumps(header, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# Build the index entry for a saved chat
+def build_index_entry(
+    date_str: str,
+    messages: list,
+    stat: os.stat_result,
+    dead_records: int = 0,
+    chat_format: str = "jsonl",
+    offset: int = 0,
+    title: str = None
+) -> dict:
+    header = messages[0] if messages and isinstance(messages[0], dict) and "model" in messages[0] else {}
+    body = messages[1:] if header else messages
+    return {
+        "date": date_str,
+        "model": header.get("model", "unknown"),
+        "timestamp": date_str,
+        "message_count": offset + len(body),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "title": title if title is not None else get_chat_title(body),
+        "format": chat_format,
+        "header_hash": get_header_hash(header) if header else None,
+        "dead_records": dead_records,
+    }
+
+def _read_index() -> dict:
     try:
-        files = sorted(
-            [f for f in os.listdir(CHAT_DIR) if f.endswith(".json")],
-            reverse=True
-        )
-        return [os.path.splitext(f)[0] for f in files]
+        with open(os.path.join(get_chat_dir(), INDEX_FILE_NAME), "r", encoding="utf-8") as f:
+            return json.load(f).get("chats", {})
+    except (FileNotFoundError, json.JSONDecodeError, OSError, AttributeError):
+        return {}
+
+# Persist the index atomically and remember it in-process
+def _write_index(chats: dict) -> None:
+    chat_dir = get_chat_dir()
+    ensure_directory_exists(chat_dir)
+    index_file = os.path.join(chat_dir, INDEX_FILE_NAME)
+    tmp_path = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 2, "chats": chats}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_file)
+        _set_cached_index(chat_dir, os.stat(chat_dir).st_mtime_ns, chats)
+    except (PermissionError, OSError):
+        _set_cached_index(chat_dir, None, None)
+
+# Serialize writers of one chat directory (sessions and processes); other users' directories aren't blocked
+def chat_dir_lock():
+    ensure_directory_exists(get_chat_dir())
+    return file_lock(os.path.join(get_chat_dir(), ".index"))
+
+# Load the index, reconciling it with files added or removed out of band.
+# Returns a copy the caller may modify.
+def load_chat_index() -> dict:
+    chat_dir = get_chat_dir()
+    try:
+        dir_mtime = os.stat(chat_dir).st_mtime_ns
     except FileNotFoundError:
+        return {}
+    chats = _get_cached_index(chat_dir, dir_mtime)
+    if chats is not None:
+        return chats
+    with chat_dir_lock():
+        return _load_chat_index()
+
+# load_chat_index for callers already holding chat_dir_lock (the repair may rewrite the index)
+def _load_chat_index() -> dict:
+    chat_dir = get_chat_dir()
+    try:
+        dir_mtime = os.stat(chat_dir).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    chats = _get_cached_index(chat_dir, dir_mtime)
+    if chats is not None:
+        return chats
+
+    chats = _read_index()
+    changed = False
+    on_disk = set()
+    for entry in os.scandir(chat_dir):
+        if entry.name.startswith("."):
+            continue
+        date_str, ext = os.path.splitext(entry.name)
+        if ext not in (CHAT_EXT, LEGACY_EXT):
+            continue
+        on_disk.add(date_str)
+        stat = entry.stat()
+        known = chats.get(date_str)
+        if known and known.get("size") == stat.st_size and known.get("mtime") == stat.st_mtime:
+            continue
+        if ext == CHAT_EXT:
+            header, messages, dead_records = _replay_records(_read_records(entry.path))
+            chats[date_str] = build_index_entry(date_str, ([header] if header else []) + messages, stat, dead_records)
+        else:
+            chats[date_str] = build_index_entry(date_str, load_chat_by_date(date_str), stat, chat_format="json")
+        changed = True
+
+    for date_str in set(chats) - on_disk:
+        del chats[date_str]
+        changed = True
+
+    if changed:
+        _write_index(chats)
+    else:
+        _set_cached_index(chat_dir, dir_mtime, chats)
+    return chats
+
+# Open the current user's search index; None if SQLite can't provide it (e.g. built without FTS5)
+def get_search_index():
+    chat_dir = get_chat_dir()
+    with _search_indexes_lock:
+        if chat_dir not in _search_indexes:
+            try:
+                ensure_directory_exists(chat_dir)
+                _search_indexes[chat_dir] = ChatSearchIndex(os.path.join(chat_dir, SEARCH_DB_NAME))
+            except sqlite3.Error as e:
+                print(f"Chat search unavailable: {e}")
+                return None
+        return _search_indexes[chat_dir]
+
+# Bring the search index up to date for chats saved before it existed or changed out of band
+def sync_search_index() -> None:
+    index = get_search_index()
+    if index is None:
+        return
+    chats = load_chat_index()
+    try:
+        for chat_id in index.get_stale_chats({d: (e["message_count"], e["size"]) for d, e in chats.items()}):
+            _, body = _split_header(load_chat_by_date(chat_id))
+            index.add_messages(chat_id, 0, body, chats[chat_id]["message_count"], chats[chat_id]["size"], reset=True)
+    except sqlite3.Error as e:
+        print(f"Failed to update chat search index: {e}")
+
+# Ranked message hits for a free-text query, with the chat's index entry attached
+def search_chat_history(query: str, limit: int = SEARCH_LIMIT) -> list:
+    index = get_search_index()
+    if index is None or not query.strip():
         return []
+    sync_search_index()
+    chats = load_chat_index()
+    try:
+        hits = index.search(query, limit)
+    except sqlite3.Error as e:
+        print(f"Chat search failed: {e}")
+        return []
+    return [dict(hit, chat=chats[hit["chat_id"]]) for hit in hits if hit["chat_id"] in chats]
+
+# Index the messages a save appended (or the whole chat if the index had fallen behind)
+def _index_saved_messages(chat_id: str, previous: dict, entry: dict, position: int, messages: list) -> None:
+    index = get_search_index()
+    if index is None:
+        return
+    try:
+        reset = position == 0
+        if not reset and index.get_state(chat_id) != (previous.get("message_count"), previous.get("size")):
+            position, messages, reset = 0, _split_header(load_chat_by_date(chat_id))[1], True
+        index.add_messages(chat_id, position, messages, entry["message_count"], entry["size"], reset=reset)
+    except sqlite3.Error as e:
+        print(f"Failed to update chat search index: {e}")
+
+# List index entries for all saved chats, newest first
+def list_chats() -> list:
+    chats = load_chat_index()
+    return [chats[date_str] for date_str in sorted(chats, reverse=True)]
+
+# Read JSONL records, skipping a torn trailing line from an interrupted append
+def _read_records(path: str) -> list:
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except (FileNotFoundError, OSError):
+        return []
+    return records
+
+# Replay a conversation log into (header, messages, superseded record count)
+def _replay_records(records: list) -> tuple:
+    header = {}
+    messages = []
+    dead_records = 0
+    for record in records:
+        kind = record.get("type")
+        if kind == "header":
+            if header:
+                dead_records += 1
+            header = record.get("header", {})
+        elif kind == "message":
+            messages.append(record.get("message", {}))
+        elif kind == "reset":
+            dead_records += len(messages) + 1
+            messages = []
+    return header, messages, dead_records
 
 # Load chat by date
 def load_chat_by_date(date_str: str) -> list:
-    path = os.path.join(CHAT_DIR, f"{date_str}.json")
+    path = get_chat_path(date_str)
+    if os.path.exists(path):
+        header, messages, _ = _replay_records(_read_records(path))
+        return ([header] if header else []) + messages
+
+    path = get_legacy_chat_path(date_str)
     if not os.path.exists(path):
         return []
     try:
@@ -36,37 +311,162 @@ def load_chat_by_date(date_str: str) -> list:
     except (FileNotFoundError, json.JSONDecodeError):
         return []
 
+def _split_header(chat: list) -> tuple:
+    if chat and isinstance(chat[0], dict) and "model" in chat[0]:
+        return chat[0], chat[1:]
+    return {}, chat
+
+# (header, messages) of a chat, replaying its log only when the file changed since the last read.
+# The result is shared: callers copy what they hand out.
+def _load_cached_chat(date_str: str) -> tuple:
+    path = get_chat_path(date_str)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return _split_header(load_chat_by_date(date_str))
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _chat_cache_lock:
+        cached = _chat_cache.get(path)
+        if cached is not None and cached[0] == key:
+            _chat_cache.move_to_end(path)
+            return cached[1], cached[2]
+    header, messages, _ = _replay_records(_read_records(path))
+    with _chat_cache_lock:
+        _chat_cache[path] = (key, header, messages)
+        _chat_cache.move_to_end(path)
+        while len(_chat_cache) > CHAT_CACHE_SIZE:
+            _chat_cache.popitem(last=False)
+    return header, messages
+
+# Load only the newest `limit` messages of a chat.
+# Returns (header, messages, offset of the first returned message within the chat).
+def load_chat_window(date_str: str, limit: int) -> tuple:
+    header, body = _load_cached_chat(date_str)
+    offset = max(0, len(body) - limit)
+    return dict(header), [dict(m) for m in body[offset:]], offset
+
+# Messages [start, end) of a saved chat, used to page through turns not held in session
+def load_chat_slice(date_str: str, start: int, end: int) -> list:
+    _, body = _load_cached_chat(date_str)
+    return [dict(m) for m in body[max(0, start):max(0, end)]]
+
 # Delete chat by date
 def delete_chat_by_date(date_str: str) -> None:
-    path = os.path.join(CHAT_DIR, f"{date_str}.json")
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except (FileNotFoundError, PermissionError):
-        pass
+    with chat_dir_lock():
+        chats = _load_chat_index()
+        for path in (get_chat_path(date_str), get_legacy_chat_path(date_str)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except (FileNotFoundError, PermissionError):
+                return
+
+        if date_str in chats:
+            del chats[date_str]
+            _write_index(chats)
+
+    index = get_search_index()
+    if index is not None:
+        try:
+            index.remove_chat(date_str)
+        except sqlite3.Error as e:
+            print(f"Failed to update chat search index: {e}")
 
-# Save chat history
-def save_chat_history(messages: list) -> None:
+# Rewrite a conversation log with only its current header and messages
+def compact_chat(chat_id: str, header: dict, messages: list) -> None:
+    path = get_chat_path(chat_id)
+    tmp_path = f"{path}.tmp"
+    records = ([{"type": "header", "header": header}] if header else []) + [{"type": "message", "message": m} for m in messages]
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+    os.replace(tmp_path, path)
+
+# Save chat history by appending only what changed since the last save.
+# `offset` is the number of earlier messages that are on disk but not in `messages`.
+# Returns the chat ID, which callers pass back in to keep appending to the same conversation.
+def save_chat_history(messages: list, chat_id: str = None, offset: int = 0) -> str:
     if not messages:
-        return
+        return chat_id
+    # Held across the index read-modify-write so concurrent sessions of a user can't clobber it
+    with chat_dir_lock():
+        return _save_chat_history(messages, chat_id, offset)
+
+def _save_chat_history(messages: list, chat_id: str, offset: int) -> str:
+    chat_id = chat_id or new_chat_id()
+    path = get_chat_path(chat_id)
+    legacy_path = get_legacy_chat_path(chat_id)
+    chats = _load_chat_index()
+
+    header = messages[0] if isinstance(messages[0], dict) and "model" in messages[0] else {}
+    if header:
+        header["system_prompt"] = st.session_state.get("custom_system_prompt", "")
+    body = messages[1:] if header else messages
 
-    ensure_directory_exists(CHAT_DIR)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    path = os.path.join(CHAT_DIR, f"{timestamp}.json")
+    entry = chats.get(chat_id, {})
+    is_log = entry.get("format") == "jsonl" and os.path.exists(path)
+    if is_log:
+        stored_count = entry.get("message_count", 0)
+        header_hash = entry.get("header_hash")
+        dead_records = entry.get("dead_records", 0)
+    else:
+        stored_count, header_hash, dead_records = 0, None, 0
+        # A legacy chat opened as a window: the new log must start with the turns that were never loaded
+        if offset and entry:
+            body = _split_header(load_chat_by_date(chat_id))[1][:offset] + body
+            offset = 0
+
+    records = []
+    if header and get_header_hash(header) != header_hash:
+        if header_hash:
+            dead_records += 1
+        records.append({"type": "header", "header": header})
+    if offset + len(body) < stored_count:
+        # The conversation shrank: start over within the same log
+        if offset:
+            body = _split_header(load_chat_by_date(chat_id))[1][:offset] + body
+            offset = 0
+        records.append({"type": "reset"})
+        dead_records += stored_count + 1
+        stored_count = 0
+    new_messages = body[max(0, stored_count - offset):]
+    records += [{"type": "message", "message": m} for m in new_messages]
+    if not records:
+        return chat_id
 
     try:
-        if isinstance(messages[0], dict) and "model" in messages[0]:
-            messages[0]["system_prompt"] = st.session_state.get("custom_system_prompt", "")
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(messages, f, indent=2, ensure_ascii=False)
+        # A chat converted from the legacy format gets a fresh log holding the whole conversation
+        with open(path, "a" if is_log else "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        if dead_records >= COMPACT_MIN_DEAD_RECORDS:
+            compact_header, compact_body, _ = _replay_records(_read_records(path))
+            compact_chat(chat_id, compact_header, compact_body)
+            dead_records = 0
+        # Only once the complete log is on disk
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
     except (PermissionError, OSError):
-        pass
+        return chat_id
+
+    title = entry.get("title") if offset else None
+    chats[chat_id] = build_index_entry(chat_id, ([header] if header else []) + body, os.stat(path), dead_records, offset=offset, title=title)
+    _write_index(chats)
+    _index_saved_messages(chat_id, entry, chats[chat_id], max(stored_count, offset), new_messages)
+    return chat_id
 
-# Clear all chat histories
+# Clear all chat histories of the current user
 def clear_all_chats() -> None:
-    try:
-        for f in os.listdir(CHAT_DIR):
-            if f.endswith(".json"):
-                os.remove(os.path.join(CHAT_DIR, f))
-    except (FileNotFoundError, PermissionError):
-        pass
+    chat_dir = get_chat_dir()
+    with chat_dir_lock():
+        try:
+            for f in os.listdir(chat_dir):
+                if f.endswith((CHAT_EXT, LEGACY_EXT)):
+                    os.remove(os.path.join(chat_dir, f))
+        except (FileNotFoundError, PermissionError):
+            pass
+        _set_cached_index(chat_dir, None, None)
+    index = get_search_index()
+    if index is not None:
+        try:
+            index.clear()
+        except sqlite3.Error as e:
+            print(f"Failed to clear chat search index: {e}")
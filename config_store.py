@@ -0,0 +1,165 @@
+# config_store.py
+
+import os
+import json
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CONFIG_FILE = os.getenv("CONFIG_FILE", "config.json")
+# Updates arriving within this many seconds are written together
+CONFIG_WRITE_DELAY = float(os.getenv("CONFIG_WRITE_DELAY", "1.0"))
+
+# Small user settings only; the model catalog lives in model_catalog.json
+DEFAULT_SETTINGS = {
+    "api_key": "",
+    "last_selected_model": "",
+}
+# Catalog copies kept by older versions of config.json, dropped on load
+LEGACY_CATALOG_KEYS = ("saved_models", "saved_multimodal", "model_info")
+
+
+# Exclusive lock on a sidecar file, held across the read-modify-write of the config
+@contextmanager
+def file_lock(path: str):
+    with open(f"{path}.lock", "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_file(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Config file is unreadable, using defaults: {e}")
+        return {}
+
+
+# In-memory settings shared by all sessions of one user.
+# Reads never touch the disk; changed keys are written in one batch after CONFIG_WRITE_DELAY.
+# `defaults` fill in settings the file doesn't have (per-user stores inherit the shared config).
+class ConfigStore:
+    def __init__(self, path: str = CONFIG_FILE, write_delay: float = CONFIG_WRITE_DELAY, defaults: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.write_delay = write_delay
+        self.defaults = defaults or {}
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Any] = {}
+        self._timer: Optional[threading.Timer] = None
+        self._settings = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        settings = dict(DEFAULT_SETTINGS, api_key=os.getenv("OPENROUTER_API_KEY", ""))
+        settings.update(self.defaults)
+        stored = _read_file(self.path)
+        settings.update({k: v for k, v in stored.items() if k not in LEGACY_CATALOG_KEYS})
+        return settings
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._settings.get(key, default)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._settings)
+
+    # Change settings in memory and schedule a write; unchanged values cost nothing
+    def update(self, **values: Any) -> None:
+        with self._lock:
+            changed = {k: v for k, v in values.items() if self._settings.get(k) != v}
+            if not changed:
+                return
+            self._settings.update(changed)
+            self._pending.update(changed)
+            if self._timer is None:
+                self._timer = threading.Timer(self.write_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    # Write pending changes now. Other processes' keys are kept: the file is re-read under the lock
+    # and only the keys changed here are applied, then replaced atomically.
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with file_lock(self.path):
+                stored = _read_file(self.path)
+                for key in LEGACY_CATALOG_KEYS:
+                    stored.pop(key, None)
+                stored.update(pending)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(stored, f, indent=4)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save config: {e}")
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+
+    # Forget saved settings: delete the file and fall back to defaults
+    def reset(self) -> None:
+        with self._lock:
+            self._pending = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            with file_lock(self.path):
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+        except OSError as e:
+            print(f"Could not reset config: {e}")
+        with self._lock:
+            self._settings = self._load()
+
+
+# One store per config file, shared by every session that uses it
+_stores: Dict[str, ConfigStore] = {}
+_stores_lock = threading.Lock()
+
+
+# Store for a config file; stores other than the shared CONFIG_FILE default to its settings
+def get_config_store(path: str = CONFIG_FILE) -> ConfigStore:
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            defaults = None
+            if path != CONFIG_FILE:
+                shared = _stores.get(CONFIG_FILE) or _stores.setdefault(CONFIG_FILE, ConfigStore(CONFIG_FILE))
+                defaults = shared.as_dict()
+            store = _stores[path] = ConfigStore(path, defaults=defaults)
+        return store
+
+
+@atexit.register
+def flush_all() -> None:
+    for store in list(_stores.values()):
+        store.flush()
@@ -0,0 +1,229 @@
+# context_packer.py
+
+from typing import Any, Callable, Dict, List, Tuple
+
+from token_utils import (
+    CHARS_PER_TOKEN,
+    MESSAGE_OVERHEAD_TOKENS,
+    estimate_tokens,
+    estimate_message_tokens,
+    estimate_messages_tokens,
+    get_content_text
+)
+
+# Tokens kept free for provider-side formatting differences
+SAFETY_MARGIN_TOKENS = 256
+# Share of the free budget reserved for attachment text before history is packed
+ATTACHMENT_SHARE = 0.5
+# Budget for the synthetic note that replaces summarized turns
+SUMMARY_MAX_TOKENS = 512
+SUMMARY_SNIPPET_CHARS = 160
+PREVIEW_CHARS = 80
+TRUNCATION_MARKER = "\n[Truncated to fit the model's context window]"
+# Message fields used for packing only, never sent to the provider
+LOCAL_FIELDS = ("pinned",)
+
+Message = Dict[str, Any]
+# A trim policy receives the history (oldest first) and a token budget and
+# returns (messages to send, messages that were dropped)
+TrimPolicy = Callable[[List[Message], int], Tuple[List[Message], List[Message]]]
+
+
+# Keep the newest messages that fit the budget
+def drop_oldest(history: List[Message], budget: int) -> Tuple[List[Message], List[Message]]:
+    kept = []
+    used = 0
+    for m in reversed(history):
+        cost = estimate_message_tokens(m)
+        if used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+    return kept, history[:len(history) - len(kept)]
+
+
+# Keep pinned messages first (or the first user turn if nothing is pinned), then the newest ones
+def keep_pinned(history: List[Message], budget: int) -> Tuple[List[Message], List[Message]]:
+    pinned = [i for i, m in enumerate(history) if m.get("pinned")]
+    if not pinned:
+        pinned = [i for i, m in enumerate(history) if m.get("role") == "user"][:1]
+
+    kept_idx = set()
+    used = 0
+    for i in pinned:
+        cost = estimate_message_tokens(history[i])
+        if used + cost <= budget:
+            kept_idx.add(i)
+            used += cost
+    for i in reversed(range(len(history))):
+        if i in kept_idx:
+            continue
+        cost = estimate_message_tokens(history[i])
+        if used + cost > budget:
+            break
+        kept_idx.add(i)
+        used += cost
+
+    kept = [m for i, m in enumerate(history) if i in kept_idx]
+    dropped = [m for i, m in enumerate(history) if i not in kept_idx]
+    return kept, dropped
+
+
+# Build an extractive note from dropped turns (first line of each, newest kept on overflow)
+def summarize_messages(messages: List[Message], max_tokens: int = SUMMARY_MAX_TOKENS) -> str:
+    header = "Summary of earlier conversation (older turns were condensed):"
+    lines = []
+    for m in messages:
+        text = " ".join(get_content_text(m.get("content", "")).split())
+        if len(text) > SUMMARY_SNIPPET_CHARS:
+            text = text[:SUMMARY_SNIPPET_CHARS] + "…"
+        lines.append(f"- {m.get('role', 'user')}: {text}")
+
+    max_chars = max_tokens * CHARS_PER_TOKEN - len(header)
+    kept_lines = []
+    for line in reversed(lines):
+        max_chars -= len(line) + 1
+        if max_chars < 0:
+            break
+        kept_lines.append(line)
+    return "\n".join([header] + list(reversed(kept_lines)))
+
+
+# Replace the turns that don't fit with a short summary note
+def summarize_oldest(history: List[Message], budget: int) -> Tuple[List[Message], List[Message]]:
+    kept, dropped = drop_oldest(history, budget)
+    if not dropped or budget <= SUMMARY_MAX_TOKENS:
+        return kept, dropped
+    kept, dropped = drop_oldest(history, budget - SUMMARY_MAX_TOKENS)
+    summary = {"role": "system", "content": summarize_messages(dropped)}
+    return [summary] + kept, dropped
+
+
+TRIM_POLICIES: Dict[str, TrimPolicy] = {
+    "drop-oldest": drop_oldest,
+    "summarize-oldest": summarize_oldest,
+    "keep-pinned": keep_pinned,
+}
+
+
+def register_trim_policy(name: str, policy: TrimPolicy) -> None:
+    TRIM_POLICIES[name] = policy
+
+
+# Cut a message's text down to roughly `max_tokens`
+def truncate_message(message: Message, max_tokens: int) -> Tuple[Message, int]:
+    max_chars = max(0, (max_tokens - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    content = message.get("content", "")
+    if isinstance(content, list):
+        parts = []
+        cut = 0
+        for part in content:
+            if part.get("type") == "text" and len(part.get("text", "")) > max_chars:
+                cut += len(part["text"]) - max_chars
+                part = {**part, "text": part["text"][:max_chars] + TRUNCATION_MARKER}
+            parts.append(part)
+        return {**message, "content": parts}, cut
+    if len(content) <= max_chars:
+        return message, 0
+    return {**message, "content": content[:max_chars] + TRUNCATION_MARKER}, len(content) - max_chars
+
+
+def append_to_message(message: Message, text: str) -> Message:
+    content = message.get("content", "")
+    if isinstance(content, list):
+        parts = list(content)
+        for i, part in enumerate(parts):
+            if part.get("type") == "text":
+                parts[i] = {**part, "text": part.get("text", "") + text}
+                return {**message, "content": parts}
+        return {**message, "content": [{"type": "text", "text": text}] + parts}
+    return {**message, "content": content + text}
+
+
+# Drop UI-only fields (e.g. "pinned") the API doesn't accept
+def strip_local_fields(message: Message) -> Message:
+    return {k: v for k, v in message.items() if k not in LOCAL_FIELDS}
+
+
+def preview_message(message: Message) -> Dict[str, str]:
+    text = " ".join(get_content_text(message.get("content", "")).split())
+    return {"role": message.get("role", ""), "preview": text[:PREVIEW_CHARS] + ("…" if len(text) > PREVIEW_CHARS else "")}
+
+
+# Fit the system prompt, the latest turn, attachment text and as much history as
+# possible into the model's context window. Returns the messages to send and a
+# report describing everything that was dropped or truncated.
+def pack_messages(
+    system_prompt: str,
+    messages: List[Message],
+    context_length: int,
+    max_tokens: int = 0,
+    attachment_text: str = "",
+    attachment_header: str = "[File Context]",
+    policy: str = "drop-oldest"
+) -> Tuple[List[Message], Dict[str, Any]]:
+    if policy not in TRIM_POLICIES:
+        raise ValueError(f"Unknown trim policy: {policy}")
+
+    budget = max(0, int(context_length) - int(max_tokens or 0) - SAFETY_MARGIN_TOKENS)
+    system = {"role": "system", "content": system_prompt}
+    history, latest = (messages[:-1], messages[-1]) if messages else ([], None)
+    report = {
+        "policy": policy,
+        "budget": budget,
+        "dropped": [],
+        "truncated_chars": 0,
+        "attachment_chars_dropped": 0,
+        "system_tokens": 0,
+        "over_budget_tokens": 0,
+    }
+
+    used = report["system_tokens"] = estimate_message_tokens(system)
+    if latest is not None:
+        if used + estimate_message_tokens(latest) > budget:
+            latest, report["truncated_chars"] = truncate_message(latest, budget - used)
+        used += estimate_message_tokens(latest)
+    remaining = max(0, budget - used)
+
+    attachment_reserve = 0
+    if attachment_text and latest is not None:
+        attachment_reserve = min(estimate_tokens(attachment_text), int(remaining * ATTACHMENT_SHARE))
+
+    kept, dropped = TRIM_POLICIES[policy](list(history), remaining - attachment_reserve)
+    remaining -= estimate_messages_tokens(kept)
+
+    if attachment_text and latest is not None:
+        prefix = f"\n\n{attachment_header}:\n"
+        max_chars = max(0, remaining * CHARS_PER_TOKEN - len(prefix))
+        text = attachment_text
+        if len(text) > max_chars:
+            keep_chars = max(0, max_chars - len(TRUNCATION_MARKER))
+            text = text[:keep_chars] + TRUNCATION_MARKER
+            report["attachment_chars_dropped"] = len(attachment_text) - keep_chars
+        latest = append_to_message(latest, prefix + text)
+
+    packed = [system] + [strip_local_fields(m) for m in kept] + ([strip_local_fields(latest)] if latest is not None else [])
+    report["dropped"] = [preview_message(m) for m in dropped]
+    report["used"] = estimate_messages_tokens(packed)
+    # Nothing left to trim (e.g. the system prompt alone is larger than the budget)
+    report["over_budget_tokens"] = max(0, report["used"] - budget)
+    return packed, report
+
+
+# One-line description of a packing report for the UI / logs
+def describe_pack_report(report: Dict[str, Any]) -> str:
+    notes = []
+    if report.get("over_budget_tokens"):
+        if report.get("system_tokens", 0) > report["budget"]:
+            notes.append(f"system prompt alone ({report['system_tokens']} tokens) exceeds the {report['budget']}-token budget")
+        else:
+            notes.append(f"request exceeds the {report['budget']}-token budget by {report['over_budget_tokens']} tokens")
+    if report["dropped"]:
+        verb = "summarized" if report["policy"] == "summarize-oldest" else "dropped"
+        notes.append(f"{len(report['dropped'])} older message(s) {verb}")
+    if report["truncated_chars"]:
+        notes.append(f"latest message truncated by {report['truncated_chars']} chars")
+    if report["attachment_chars_dropped"]:
+        notes.append(f"attachment truncated by {report['attachment_chars_dropped']} chars")
+    return "; ".join(notes)
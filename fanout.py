@@ -0,0 +1,126 @@
+# fanout.py
+
+import time
+import queue
+import threading
+from typing import Any, Dict, List, Optional
+
+from response_cache import response_cache
+from retry_policy import RequestCancelled, call_with_retry
+
+# How often a cancellable job checks for Stop while blocked on the network
+CANCEL_POLL_INTERVAL = 0.1
+
+# Events pushed by workers: (kind, model, payload)
+#   "reset"  - a (re)try started, discard partial text
+#   "delta"  - payload is the next text chunk
+#   "retry"  - payload describes the failure and backoff
+#   "done"   - payload is the result dict (content, ttft, total_time, usage, cached)
+#   "error"  - payload is the error message
+#   "cancelled" - payload is the result dict with the text received before the stream was closed
+
+
+# Stream one model's completion into the event queue. Runs in a worker thread: no Streamlit calls here.
+# Setting `cancel_event` stops the job at any point: before an attempt, during the retry backoff, or
+# mid-stream, where the stream is closed so the provider stops generating (and billing).
+def stream_model(
+    client,
+    params: Dict[str, Any],
+    events: queue.Queue,
+    cache_options: Dict[str, bool],
+    cancel_event: Optional[threading.Event] = None
+) -> None:
+    model = params["model"]
+    t0 = time.perf_counter()
+    parts: List[str] = []
+    state: Dict[str, Any] = {"usage": None, "first_token_at": None, "stream": None}
+    finished = threading.Event()
+    try:
+        cached = response_cache.get(params, **cache_options)
+        if cached is not None:
+            events.put(("delta", model, cached["content"]))
+            events.put(("done", model, {
+                "content": cached["content"], "ttft": 0.0, "total_time": 0.0, "cached": True,
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "cached": True}
+            }))
+            return
+
+        if cancel_event is not None:
+            # Closes the open stream as soon as Stop is pressed, even while waiting for the first chunk
+            threading.Thread(target=_close_on_cancel, args=(cancel_event, finished, state), daemon=True).start()
+
+        def attempt():
+            events.put(("reset", model, None))
+            parts.clear()
+            state.update(usage=None, first_token_at=None)
+            stream = state["stream"] = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **params)
+            try:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled()
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RequestCancelled()
+                    if getattr(chunk, "usage", None):
+                        state["usage"] = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if delta:
+                        if state["first_token_at"] is None:
+                            state["first_token_at"] = time.perf_counter()
+                        parts.append(delta)
+                        events.put(("delta", model, delta))
+            except Exception:
+                # Reading from a stream closed by _close_on_cancel fails; that is the cancel, not an error
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled()
+                raise
+            finally:
+                state["stream"] = None
+                stream.close()
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+
+        call_with_retry(
+            attempt,
+            model,
+            on_retry=lambda n, kind, delay: events.put(("retry", model, f"{kind.replace('_', ' ')}, retrying in {delay:.1f}s")),
+            cancel_event=cancel_event
+        )
+        result = _build_result(parts, state, t0)
+        response_cache.put(params, {"content": result["content"]}, **cache_options)
+        events.put(("done", model, result))
+    except RequestCancelled:
+        events.put(("cancelled", model, _build_result(parts, state, t0)))
+    except Exception as e:
+        events.put(("error", model, str(e)))
+    finally:
+        finished.set()
+
+
+def _close_on_cancel(cancel_event: threading.Event, finished: threading.Event, state: Dict[str, Any]) -> None:
+    while not finished.is_set():
+        if cancel_event.wait(CANCEL_POLL_INTERVAL):
+            stream = state.get("stream")
+            if stream is not None:
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            return
+
+
+def _build_result(parts: List[str], state: Dict[str, Any], t0: float) -> Dict[str, Any]:
+    end = time.perf_counter()
+    usage = state["usage"]
+    return {
+        "content": "".join(parts),
+        "ttft": (state["first_token_at"] or end) - t0,
+        "total_time": end - t0,
+        "cached": False,
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "cost": getattr(usage, "cost", None)
+        } if usage is not None else None
+    }
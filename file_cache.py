@@ -0,0 +1,143 @@
+# file_cache.py
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+CACHE_DIR = os.getenv("FILE_CACHE_DIR", os.path.join(".cache", "extracted"))
+# Upper bound for cached extraction results, in bytes (memory and disk separately)
+MAX_CACHE_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PERSIST_TO_DISK = os.getenv("FILE_CACHE_PERSIST", "1") == "1"
+
+
+# Content hash used as the cache key for uploaded bytes
+def get_content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Digests of already-seen uploads, so reruns don't rehash the same bytes
+_upload_digests: "OrderedDict[str, str]" = OrderedDict()
+_upload_digests_lock = threading.Lock()
+MAX_UPLOAD_DIGESTS = 256
+
+
+# Content hash of a Streamlit UploadedFile (or any file-like object with getvalue())
+def get_upload_digest(uploaded_file) -> str:
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id:
+        with _upload_digests_lock:
+            if file_id in _upload_digests:
+                _upload_digests.move_to_end(file_id)
+                return _upload_digests[file_id]
+    # Hashed outside the lock: sessions uploading different files don't wait on each other
+    digest = get_content_digest(uploaded_file.getvalue())
+    if file_id:
+        with _upload_digests_lock:
+            _upload_digests[file_id] = digest
+            while len(_upload_digests) > MAX_UPLOAD_DIGESTS:
+                _upload_digests.popitem(last=False)
+    return digest
+
+
+# Size-bounded LRU cache of extraction results keyed by content hash.
+# Sizes are UTF-8 encoded bytes, the same measure as the files on disk.
+class ExtractionCache:
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES, cache_dir: Optional[str] = CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        # key -> (value, encoded size)
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._size = 0
+        # Running total of the cache directory; None until the first write scans it
+        self._disk_size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                encoded = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        value = encoded.decode("utf-8", errors="replace")
+        self._remember(key, value, len(encoded))
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        encoded = value.encode("utf-8")
+        self._remember(key, value, len(encoded))
+        if self.cache_dir:
+            self._persist(key, encoded)
+
+    def _remember(self, key: str, value: str, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def _persist(self, key: str, encoded: bytes) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_size is not None:
+                    self._disk_size += len(encoded) - replaced
+                over = self._disk_size is None or self._disk_size > self.max_bytes
+            # The directory is only listed on the first write and when the running total goes over the limit
+            if over:
+                self._prune_disk()
+        except OSError as e:
+            print(f"Could not persist extraction cache entry: {e}")
+
+    # Drop least recently used files once the cache directory exceeds the limit, and resync the running total
+    # (other processes may share the directory)
+    def _prune_disk(self) -> None:
+        files = [(entry, entry.stat()) for entry in os.scandir(self.cache_dir) if entry.name.endswith(".txt")]
+        total = sum(stat.st_size for _, stat in files)
+        if total > self.max_bytes:
+            for entry, stat in sorted(files, key=lambda item: item[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(entry.path)
+                    total -= stat.st_size
+                except OSError:
+                    pass
+        with self._lock:
+            self._disk_size = total
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# Shared by every session: entries are content-addressed, so they are safe to reuse
+extraction_cache = ExtractionCache(cache_dir=CACHE_DIR if PERSIST_TO_DISK else None)
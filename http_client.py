@@ -0,0 +1,74 @@
+# http_client.py
+
+import os
+import threading
+import importlib.util
+from typing import TYPE_CHECKING, Dict, Tuple
+
+# openai, httpx and requests are imported on first use: they dominate the app's import time
+if TYPE_CHECKING:
+    import requests
+    from openai import OpenAI
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+# Connection pool and timeout settings shared by every client
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_sessions: Dict[Tuple[str, str], "requests.Session"] = {}
+_openai_clients: Dict[Tuple[str, str, str, str], "OpenAI"] = {}
+_lock = threading.Lock()
+
+
+# Keep-alive requests session with a sized connection pool, one per API key and base URL
+def get_session(api_key: str = "", base_url: str = OPENROUTER_BASE_URL) -> "requests.Session":
+    key = (api_key, base_url)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if api_key:
+                session.headers["Authorization"] = f"Bearer {api_key}"
+            _sessions[key] = session
+        return session
+
+
+# Pooled OpenAI-compatible client (HTTP/2 when available), one per API key, base URL and site headers.
+# SDK retries are disabled: retry_policy.call_with_retry owns backoff and circuit breaking.
+def get_openai_client(api_key: str, base_url: str = OPENROUTER_BASE_URL, site_url: str = "", site_name: str = "") -> "OpenAI":
+    key = (api_key, base_url, site_url, site_name)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            import httpx
+            from openai import OpenAI
+            http_client = httpx.Client(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=POOL_SIZE,
+                    max_keepalive_connections=POOL_SIZE,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+            )
+            client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers={
+                    "HTTP-Referer": site_url,
+                    "X-Title": site_name
+                },
+                http_client=http_client,
+                max_retries=0
+            )
+            _openai_clients[key] = client
+        return client
@@ -0,0 +1,75 @@
+# image_prep.py
+
+import io
+import os
+import base64
+from typing import TYPE_CHECKING, Any, Dict
+
+# Pillow is imported on first use: most sessions never upload an image
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Longest side after downscaling; vision models downscale larger images themselves anyway
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1568"))
+# Output format for opaque images (JPEG or WEBP); images with transparency are kept as PNG
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+# Pillow formats that are a variant of a supported one (MPO: multi-picture JPEG from phones and cameras,
+# whose first picture is a plain JPEG stream)
+FORMAT_ALIASES = {"MPO": "JPEG"}
+# Animations are sent unchanged in these formats; other multi-frame images keep only their first frame
+ANIMATED_FORMATS = ("GIF", "PNG", "WEBP")
+
+
+# Cache key suffix: prepared bytes depend on the settings as well as the content
+def get_settings_key() -> str:
+    return f"{IMAGE_MAX_DIMENSION}-{IMAGE_FORMAT}-{IMAGE_QUALITY}"
+
+
+def _has_alpha(image: "Image.Image") -> bool:
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+# Downscale and re-encode an image for upload.
+# Returns base64 data, its MIME type and the byte sizes before and after.
+def prepare_image(data: bytes) -> Dict[str, Any]:
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(io.BytesIO(data))
+        source_format = FORMAT_ALIASES.get(image.format, image.format) or "PNG"
+        # Animated images would lose their frames; send them unchanged
+        if getattr(image, "is_animated", False) and source_format in ANIMATED_FORMATS:
+            raise ValueError("animated image")
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > IMAGE_MAX_DIMENSION
+        if resized:
+            image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+        target = "PNG" if _has_alpha(image) else IMAGE_FORMAT
+        if target == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        save_kwargs = {"optimize": True} if target == "PNG" else {"quality": IMAGE_QUALITY}
+        image.save(buffer, format=target, **save_kwargs)
+        prepared = buffer.getvalue()
+
+        # Keep the original when re-encoding a small image doesn't pay off and the API accepts its format
+        if not resized and len(prepared) >= len(data) and source_format in MIME_TYPES:
+            prepared, target = data, source_format
+    except Exception as e:
+        print(f"Image preparation skipped: {e}")
+        prepared, target = data, "PNG"
+        try:
+            source_format = Image.open(io.BytesIO(data)).format
+            target = FORMAT_ALIASES.get(source_format, source_format) or target
+        except Exception:
+            pass
+
+    return {
+        "data": base64.b64encode(prepared).decode("utf-8"),
+        "mime": MIME_TYPES.get(target, f"image/{target.lower()}"),
+        "original_bytes": len(data),
+        "prepared_bytes": len(prepared)
+    }
@@ -0,0 +1,111 @@
+# job_runner.py
+
+import os
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from fanout import stream_model
+
+# Worker threads shared by all browser sessions; each session runs one generation at a time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "16"))
+# Finished jobs nobody collected (the session ended mid-generation) are dropped after this many seconds
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "600"))
+
+# Job states
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+
+
+# One in-flight completion. The worker only pushes events; the script thread folds them into
+# text/status with poll(), so a rerun can pick up exactly where the previous one stopped.
+class Job:
+    def __init__(self, job_id: str, model: str):
+        self.id = job_id
+        self.model = model
+        self.events: queue.Queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.status = JOB_RUNNING
+        self.text = ""
+        self.notice: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None  # set by the worker thread
+
+    # Apply queued worker events; returns the current status
+    def poll(self) -> str:
+        while True:
+            try:
+                kind, _, payload = self.events.get_nowait()
+            except queue.Empty:
+                return self.status
+            if kind == "reset":
+                self.text = ""
+            elif kind == "delta":
+                self.text += payload
+                self.notice = None
+            elif kind == "retry":
+                self.notice = payload
+            elif kind == "done":
+                self.status, self.result, self.text = JOB_DONE, payload, payload["content"]
+            elif kind == "cancelled":
+                self.status, self.result, self.text = JOB_CANCELLED, payload, payload["content"]
+            elif kind == "error":
+                self.status, self.error = JOB_ERROR, payload
+
+    # Ask the worker to close the stream; the provider stops generating (and billing) once it's closed
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+
+# Process-wide pool that owns in-flight completions across Streamlit reruns
+class JobRunner:
+    def __init__(self, max_workers: int = JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    # Start streaming a completion in the background; returns the job to poll
+    def submit(self, client, params: Dict[str, Any], cache_options: Dict[str, bool]) -> Job:
+        job = Job(uuid.uuid4().hex, params["model"])
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, client, params, cache_options)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    @staticmethod
+    def _run(job: Job, client, params: Dict[str, Any], cache_options: Dict[str, bool]) -> None:
+        try:
+            stream_model(client, params, job.events, cache_options, job.cancel_event)
+        finally:
+            job.finished_at = time.time()
+
+    # Drop jobs whose worker finished long ago without the session collecting them
+    def _prune(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > JOB_RETENTION:
+                del self._jobs[job_id]
+
+
+# Shared by every session; sessions keep only the id of their pending job
+job_runner = JobRunner()
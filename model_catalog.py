@@ -0,0 +1,158 @@
+# model_catalog.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from http_client import get_session
+
+if TYPE_CHECKING:
+    import requests
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+CATALOG_FILE = os.getenv("MODEL_CATALOG_FILE", "model_catalog.json")
+# Seconds before the cached catalog is revalidated against the API
+CATALOG_TTL = int(os.getenv("MODEL_CATALOG_TTL", "3600"))
+
+ParsedCatalog = Tuple[List[str], List[str], Dict[str, Any]]
+
+# In-process catalog cache keyed by base URL, shared by every Streamlit session
+_catalogs: Dict[str, Dict[str, Any]] = {}
+_refresh_lock = threading.Lock()
+# Base URLs with a background refresh in flight
+_background_refreshes = set()
+_background_lock = threading.Lock()
+
+
+# Check whether a catalog entry is still within its TTL
+def is_fresh(entry: Optional[Dict[str, Any]], ttl: int = CATALOG_TTL) -> bool:
+    return bool(entry) and time.time() - entry.get("fetched_at", 0) < ttl
+
+
+# Load the on-disk catalog snapshot
+def load_snapshot(base_url: str = OPENROUTER_BASE_URL) -> Optional[Dict[str, Any]]:
+    try:
+        with open(CATALOG_FILE, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return None
+    if snapshot.get("base_url") != base_url or "model_info" not in snapshot:
+        return None
+    return snapshot
+
+
+# Persist the catalog snapshot atomically (temp file + rename)
+def save_snapshot(entry: Dict[str, Any]) -> None:
+    tmp_path = f"{CATALOG_FILE}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, CATALOG_FILE)
+    except OSError as e:
+        print(f"Could not write model catalog snapshot: {e}")
+
+
+# Return the cached catalog entry without touching the network
+def get_cached_catalog(base_url: str = OPENROUTER_BASE_URL) -> Optional[Dict[str, Any]]:
+    entry = _catalogs.get(base_url)
+    if entry is None:
+        entry = load_snapshot(base_url)
+        if entry is not None:
+            _catalogs[base_url] = entry
+    return entry
+
+
+def _request_catalog(api_key: str, entry: Optional[Dict[str, Any]], base_url: str) -> "requests.Response":
+    headers = {
+        "HTTP-Referer": "",
+        "X-Title": ""
+    }
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return get_session(api_key, base_url).get(f"{base_url}/models", headers=headers, timeout=30)
+
+
+# Get the model catalog, revalidating it only when the TTL has expired.
+# Returns the catalog entry and whether its contents changed on this call.
+def get_catalog(
+    api_key: str,
+    parser: Callable[[List[Dict[str, Any]]], ParsedCatalog],
+    force_refresh: bool = False,
+    base_url: str = OPENROUTER_BASE_URL,
+    ttl: int = CATALOG_TTL
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    entry = get_cached_catalog(base_url)
+    if not force_refresh and is_fresh(entry, ttl):
+        return entry, False
+
+    with _refresh_lock:
+        # Another session may have refreshed the catalog while we waited
+        entry = _catalogs.get(base_url, entry)
+        if not force_refresh and is_fresh(entry, ttl):
+            return entry, False
+
+        try:
+            res = _request_catalog(api_key, entry, base_url)
+            if res.status_code == 304 and entry:
+                entry = {**entry, "fetched_at": time.time()}
+                _catalogs[base_url] = entry
+                save_snapshot(entry)
+                return entry, False
+            res.raise_for_status()
+        except Exception as e:
+            print(f"Model catalog refresh failed: {e}")
+            # Serve the stale catalog rather than nothing
+            return entry, False
+
+        content_hash = hashlib.sha256(res.content).hexdigest()
+        changed = not entry or entry.get("content_hash") != content_hash
+        if changed:
+            models, multimodal, model_info = parser(res.json().get("data", []))
+        else:
+            models, multimodal, model_info = entry["models"], entry["multimodal"], entry["model_info"]
+
+        entry = {
+            "base_url": base_url,
+            "models": models,
+            "multimodal": multimodal,
+            "model_info": model_info,
+            "etag": res.headers.get("ETag", ""),
+            "last_modified": res.headers.get("Last-Modified", ""),
+            "content_hash": content_hash,
+            "fetched_at": time.time()
+        }
+        _catalogs[base_url] = entry
+        save_snapshot(entry)
+        return entry, changed
+
+
+# Revalidate a stale catalog on a daemon thread so the caller can render from the cache right away.
+# Returns True if a refresh was started; sessions pick up the new catalog on their next rerun.
+def refresh_catalog_in_background(
+    api_key: str,
+    parser: Callable[[List[Dict[str, Any]]], ParsedCatalog],
+    base_url: str = OPENROUTER_BASE_URL,
+    ttl: int = CATALOG_TTL
+) -> bool:
+    if is_fresh(get_cached_catalog(base_url), ttl):
+        return False
+    with _background_lock:
+        if base_url in _background_refreshes:
+            return False
+        _background_refreshes.add(base_url)
+
+    def refresh():
+        try:
+            get_catalog(api_key, parser, base_url=base_url, ttl=ttl)
+        finally:
+            with _background_lock:
+                _background_refreshes.discard(base_url)
+
+    threading.Thread(target=refresh, name="catalog-refresh", daemon=True).start()
+    return True
@@ -0,0 +1,101 @@
+# preflight.py
+
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from context_packer import SAFETY_MARGIN_TOKENS
+from token_utils import estimate_tokens, estimate_messages_tokens, get_token_prices
+
+# Completion tokens assumed per request when the scenario sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("PREFLIGHT_COMPLETION_TOKENS", "1024"))
+
+# Context fit of a model×task pair
+FIT_OK = 0
+FIT_TRUNCATED = 1  # the attachment will be trimmed to fit
+FIT_FAIL = 2       # the request cannot succeed: prompt alone overflows, or the model isn't in the catalog
+FIT_UNKNOWN = 3    # no cached catalog to check against
+FIT_LABELS = {FIT_OK: "ok", FIT_TRUNCATED: "trim", FIT_FAIL: "FAIL", FIT_UNKNOWN: "?"}
+
+
+# Estimate input tokens, cost and context fit for every model×task pair.
+# tasks: dicts with system_prompt, user_prompt and attachment_text.
+# model_info: catalog metadata (pricing, context_length) keyed by model id, or None if no catalog is cached.
+def estimate_scenario(
+    models: List[str],
+    tasks: List[Dict[str, str]],
+    model_info: Optional[Dict[str, Any]],
+    max_tokens: Optional[int] = None
+) -> Dict[str, Any]:
+    completion = int(max_tokens or DEFAULT_COMPLETION_TOKENS)
+    # Tokens that can't be trimmed (system + user prompt) and the attachment, which the packer may trim
+    fixed = np.array([
+        estimate_messages_tokens([
+            {"role": "system", "content": task["system_prompt"]},
+            {"role": "user", "content": task["user_prompt"]}
+        ])
+        for task in tasks
+    ], dtype=np.int64)
+    attachment = np.array([estimate_tokens(task["attachment_text"]) for task in tasks], dtype=np.int64)
+
+    catalog = model_info or {}
+    known = np.array([model in catalog for model in models], dtype=bool)
+    prices = np.array([get_token_prices(catalog.get(model, {})) for model in models], dtype=float).reshape(len(models), 2)
+    context = np.array([catalog.get(model, {}).get("context_length", 0) for model in models], dtype=np.int64)
+
+    # Input budget per model after reserving the completion and the packer's safety margin
+    budget = context - completion - SAFETY_MARGIN_TOKENS
+    full = fixed + attachment
+    input_tokens = np.where(known[:, None], np.minimum(full[None, :], np.maximum(budget[:, None], fixed[None, :])), full[None, :])
+    cost = input_tokens * prices[:, 0:1] + completion * prices[:, 1:2]
+
+    fit = np.full((len(models), len(tasks)), FIT_OK, dtype=np.int8)
+    fit[known[:, None] & (full[None, :] > budget[:, None])] = FIT_TRUNCATED
+    fit[known[:, None] & (fixed[None, :] > budget[:, None])] = FIT_FAIL
+    if model_info is None:
+        fit[:] = FIT_UNKNOWN
+    else:
+        fit[~known, :] = FIT_FAIL
+
+    return {
+        "models": models,
+        "completion_tokens": completion,
+        "input_tokens": input_tokens,
+        "cost": cost,
+        "fit": fit
+    }
+
+
+# Indexes (model, task) of pairs that will certainly fail
+def get_failing_pairs(estimate: Dict[str, Any]) -> List[tuple]:
+    return [tuple(int(i) for i in pair) for pair in np.argwhere(estimate["fit"] == FIT_FAIL)]
+
+
+# models×tasks table of estimated cost and fit, with per-model and grand totals
+def format_estimate(estimate: Dict[str, Any], task_names: List[str]) -> str:
+    models = estimate["models"]
+    sendable = estimate["fit"] != FIT_FAIL
+    # Per-model totals only count pairs that will be sent; FAIL pairs are listed next to the total
+    header = ["model"] + task_names + ["total $"]
+    rows = []
+    for m, model in enumerate(models):
+        cells = [model]
+        for t in range(len(task_names)):
+            cells.append(f"${estimate['cost'][m, t]:.4f} {FIT_LABELS[int(estimate['fit'][m, t])]}")
+        failing = int((~sendable[m]).sum())
+        cells.append(f"${estimate['cost'][m][sendable[m]].sum():.4f}" + (f" (+{failing} FAIL)" if failing else ""))
+        rows.append(cells)
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+
+    def render(cells):
+        return "  ".join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(cells, widths)))
+
+    lines = [render(header), render(["-" * w for w in widths])] + [render(row) for row in rows]
+    lines.append("")
+    lines.append(
+        f"Input tokens (est.): {int(estimate['input_tokens'][sendable].sum())}, "
+        f"completion budget {estimate['completion_tokens']} per request, "
+        f"estimated cost ${estimate['cost'][sendable].sum():.4f} for {int(sendable.sum())} of {sendable.size} pairs"
+    )
+    return "\n".join(lines)
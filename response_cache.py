@@ -0,0 +1,142 @@
+# response_cache.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(".cache", "responses"))
+# Opt-in: responses are only cached when RESPONSE_CACHE=1 (or enabled per call)
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "0") == "1"
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Cache for non-deterministic settings too (temperature > 0)
+CACHE_FORCE = os.getenv("RESPONSE_CACHE_FORCE", "0") == "1"
+# Eviction scans the cache directory, so it only runs every N writes
+EVICT_EVERY = 50
+
+# Request fields that affect the completion; anything else (stream flags, headers) is ignored
+KEY_FIELDS = (
+    "model", "messages", "temperature", "top_p", "top_k", "max_tokens",
+    "presence_penalty", "frequency_penalty", "repetition_penalty", "stop", "seed",
+    "logit_bias", "response_format", "tools", "tool_choice"
+)
+
+
+# Canonical SHA-256 of the request payload
+def get_request_key(payload: Dict[str, Any]) -> str:
+    canonical = {k: payload[k] for k in KEY_FIELDS if payload.get(k) is not None}
+    encoded = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# Only deterministic requests are cacheable unless the caller forces it
+def is_cacheable(payload: Dict[str, Any], force: bool = False) -> bool:
+    return force or float(payload.get("temperature", 1.0)) == 0.0
+
+
+# On-disk response cache with TTL and size-bounded LRU eviction
+class ResponseCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, ttl: int = CACHE_TTL, max_bytes: int = MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, payload: Dict[str, Any], force: bool = False, bypass: bool = False) -> Optional[Dict[str, Any]]:
+        if bypass or not is_cacheable(payload, force):
+            return None
+        path = self._path(get_request_key(payload))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._count(hit=False)
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.ttl:
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(hit=True)
+        return entry["response"]
+
+    def put(self, payload: Dict[str, Any], response: Dict[str, Any], force: bool = False, bypass: bool = False) -> None:
+        if bypass or not is_cacheable(payload, force):
+            return
+        path = self._path(get_request_key(payload))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created_at": time.time(), "model": payload.get("model"), "response": response}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write response cache entry: {e}")
+            return
+
+        with self._lock:
+            self._writes_since_evict += 1
+            due = self._writes_since_evict >= EVICT_EVERY
+        if due:
+            self.evict()
+
+    # Remove entries unused for longer than the TTL, then least recently used ones until under the size limit
+    def evict(self) -> None:
+        with self._lock:
+            self._writes_since_evict = 0
+            entries = []
+            now = time.time()
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if now - stat.st_mtime > self.ttl:
+                        self._remove(path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,248 @@
+# result_store.py
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+RESULTS_DB = os.getenv("BATCH_RESULTS_DB", os.path.join("batch_results", "results.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    scenario_path TEXT,
+    scenario_hash TEXT,
+    created_at TEXT
+);
+-- Prompts (with the packed attachment text) are stored once and shared by every attempt
+CREATE TABLE IF NOT EXISTS prompts (
+    prompt_hash TEXT PRIMARY KEY,
+    system_prompt TEXT,
+    user_prompt TEXT
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    task TEXT NOT NULL,
+    task_index INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    prompt_hash TEXT,
+    attachment_path TEXT,
+    status TEXT NOT NULL,
+    error_kind TEXT,
+    status_code INTEGER,
+    error_text TEXT,
+    answer TEXT,
+    latency_sec REAL,
+    elapsed_sec REAL,
+    queue_wait_sec REAL,
+    headers_sec REAL,
+    ttft_sec REAL,
+    generation_sec REAL,
+    tokens_per_sec REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost REAL,
+    cached INTEGER DEFAULT 0,
+    context_report TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_run ON attempts (run_id, model, task_index);
+"""
+
+# Columns added after the first schema version, created on open for older databases
+ADDED_COLUMNS = {
+    "queue_wait_sec": "REAL",
+    "headers_sec": "REAL",
+    "ttft_sec": "REAL",
+    "generation_sec": "REAL",
+    "tokens_per_sec": "REAL",
+}
+# Per-attempt timings accepted by record_attempt
+TIMING_FIELDS = ("queue_wait_sec", "headers_sec", "ttft_sec", "generation_sec", "tokens_per_sec")
+
+# Percentiles reported for successful request latency
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def get_prompt_hash(system_prompt: str, user_prompt: str) -> str:
+    return hashlib.sha256(json.dumps([system_prompt, user_prompt], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Run-level SQLite store for batch attempts, safe to share between worker threads
+class ResultStore:
+    def __init__(self, path: str = RESULTS_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+        self._known_prompts = set()
+
+    def _migrate(self) -> None:
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(attempts)")}
+        with self._conn:
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE attempts ADD COLUMN {column} {column_type}")
+            # headers_sec was called connect_sec, though it always held the time until the response headers
+            if "connect_sec" in existing and "headers_sec" not in existing:
+                self._conn.execute("UPDATE attempts SET headers_sec = connect_sec")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def register_run(self, run_id: str, scenario_path: str, scenario_hash: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, scenario_path, scenario_hash, created_at) VALUES (?, ?, ?, ?)",
+                (run_id, scenario_path, scenario_hash, datetime.now().isoformat())
+            )
+
+    # Store one attempt; returns its row id
+    def record_attempt(
+        self,
+        run_id: str,
+        model: str,
+        task: str,
+        task_index: int,
+        attempt: int,
+        system_prompt: str,
+        user_prompt: str,
+        status: str,
+        answer: Optional[str] = None,
+        error: Optional[Dict[str, Any]] = None,
+        latency_sec: Optional[float] = None,
+        elapsed_sec: Optional[float] = None,
+        usage: Optional[Dict[str, Any]] = None,
+        cost: Optional[float] = None,
+        cached: bool = False,
+        attachment_path: Optional[str] = None,
+        context_report: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
+    ) -> int:
+        prompt_hash = get_prompt_hash(system_prompt, user_prompt)
+        error = error or {}
+        usage = usage or {}
+        timings = timings or {}
+        with self._lock, self._conn:
+            if prompt_hash not in self._known_prompts:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO prompts (prompt_hash, system_prompt, user_prompt) VALUES (?, ?, ?)",
+                    (prompt_hash, system_prompt, user_prompt)
+                )
+                self._known_prompts.add(prompt_hash)
+            cursor = self._conn.execute(
+                """INSERT INTO attempts (
+                    run_id, model, task, task_index, attempt, prompt_hash, attachment_path, status,
+                    error_kind, status_code, error_text, answer, latency_sec, elapsed_sec,
+                    queue_wait_sec, headers_sec, ttft_sec, generation_sec, tokens_per_sec,
+                    prompt_tokens, completion_tokens, cost, cached, context_report, timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    run_id, model, task, task_index, attempt, prompt_hash, attachment_path, status,
+                    error.get("kind"), error.get("status_code"), error.get("text") or error.get("exception"),
+                    answer, latency_sec, elapsed_sec,
+                    *(timings.get(field) for field in TIMING_FIELDS),
+                    usage.get("prompt_tokens"), usage.get("completion_tokens"),
+                    cost if cost is not None else usage.get("cost"),
+                    int(cached), json.dumps(context_report, ensure_ascii=False) if context_report else None,
+                    datetime.now().isoformat()
+                )
+            )
+            return cursor.lastrowid
+
+    # Latest run id, optionally restricted to one scenario
+    def get_latest_run(self, scenario_hash: Optional[str] = None) -> Optional[str]:
+        query = "SELECT run_id FROM runs"
+        params = ()
+        if scenario_hash:
+            query += " WHERE scenario_hash = ?"
+            params = (scenario_hash,)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY created_at DESC LIMIT 1", params).fetchone()
+        return row["run_id"] if row else None
+
+    def get_attempts(self, run_id: str) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM attempts WHERE run_id = ? ORDER BY id", (run_id,)
+            ).fetchall()
+
+    # Aggregate a run per model or per task: success rate, attempts, latency percentiles, tokens and cost
+    def aggregate(self, run_id: str, by: str = "model") -> List[Dict[str, Any]]:
+        if by not in ("model", "task"):
+            raise ValueError(f"Cannot aggregate by {by!r}")
+        groups: Dict[str, Dict[str, Any]] = {}
+        for row in self.get_attempts(run_id):
+            group = groups.setdefault(row[by], {
+                by: row[by], "pairs": {}, "attempts": 0, "cached": 0, "latencies": [], "ttfts": [], "speeds": [],
+                "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0
+            })
+            pair = (row["model"], row["task_index"])
+            group["pairs"][pair] = group["pairs"].get(pair, False) or row["status"] == "success"
+            if row["cached"]:
+                group["cached"] += 1
+            elif row["error_kind"] != "circuit_open":
+                group["attempts"] += 1
+                if row["status"] == "success" and row["latency_sec"] is not None:
+                    group["latencies"].append(row["latency_sec"])
+                if row["status"] == "success" and row["ttft_sec"] is not None:
+                    group["ttfts"].append(row["ttft_sec"])
+                if row["status"] == "success" and row["tokens_per_sec"] is not None:
+                    group["speeds"].append(row["tokens_per_sec"])
+            group["prompt_tokens"] += row["prompt_tokens"] or 0
+            group["completion_tokens"] += row["completion_tokens"] or 0
+            group["cost"] += row["cost"] or 0.0
+
+        report = []
+        for group in groups.values():
+            outcomes = list(group.pop("pairs").values())
+            latencies = np.array(group.pop("latencies"), dtype=float)
+            ttfts = np.array(group.pop("ttfts"), dtype=float)
+            speeds = np.array(group.pop("speeds"), dtype=float)
+            group["pairs"] = len(outcomes)
+            group["success_rate"] = sum(outcomes) / len(outcomes)
+            group["attempts_per_pair"] = group["attempts"] / len(outcomes)
+            for p in LATENCY_PERCENTILES:
+                group[f"p{p}"] = float(np.percentile(latencies, p)) if latencies.size else None
+            group["ttft_p50"] = float(np.median(ttfts)) if ttfts.size else None
+            group["tokens_per_sec"] = float(np.median(speeds)) if speeds.size else None
+            report.append(group)
+        return sorted(report, key=lambda g: g[by])
+
+
+# Plain-text table for the aggregated report
+def format_report(rows: List[Dict[str, Any]], by: str = "model") -> str:
+    columns = [by, "pairs", "success", "attempts/pair"] + [f"p{p} s" for p in LATENCY_PERCENTILES] + ["ttft p50 s", "tok/s", "tokens in", "tokens out", "cost $"]
+    lines = []
+    for row in rows:
+        lines.append([
+            str(row[by]),
+            str(row["pairs"]),
+            f"{row['success_rate']:.0%}",
+            f"{row['attempts_per_pair']:.2f}",
+            *(f"{row[f'p{p}']:.2f}" if row[f"p{p}"] is not None else "-" for p in LATENCY_PERCENTILES),
+            f"{row['ttft_p50']:.2f}" if row["ttft_p50"] is not None else "-",
+            f"{row['tokens_per_sec']:.1f}" if row["tokens_per_sec"] is not None else "-",
+            str(row["prompt_tokens"]),
+            str(row["completion_tokens"]),
+            f"{row['cost']:.6f}"
+        ])
+    widths = [max(len(col), *(len(line[i]) for line in lines)) if lines else len(col) for i, col in enumerate(columns)]
+
+    def render(cells):
+        return "  ".join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(cells, widths)))
+
+    return "\n".join([render(columns), render(["-" * w for w in widths])] + [render(line) for line in lines])
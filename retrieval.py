@@ -0,0 +1,124 @@
+# retrieval.py
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Attachments shorter than this are sent whole; retrieval only kicks in for large documents
+MIN_CHARS_FOR_RETRIEVAL = int(os.getenv("RETRIEVAL_MIN_CHARS", "12000"))
+CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))
+CHUNK_OVERLAP = 200
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+MAX_CACHED_INDEXES = 16
+CHUNK_SEPARATOR = "\n[...]\n"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+# Split text into overlapping chunks, preferring paragraph and line boundaries
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            boundary = max(text.rfind("\n\n", start, end), text.rfind("\n", start, end))
+            if boundary > start + chunk_chars // 2:
+                end = boundary
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+# Okapi BM25 over attachment chunks with postings stored as NumPy arrays
+class BM25Index:
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_len = np.zeros(len(chunks), dtype=np.float64)
+        for doc_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            doc_len[doc_id] = len(terms)
+            for term in terms:
+                counts = postings.setdefault(term, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        self.doc_len = doc_len
+        self.avg_len = float(doc_len.mean()) if len(chunks) else 0.0
+        n = len(chunks)
+        self.postings = {
+            term: (np.fromiter(counts.keys(), dtype=np.int64), np.fromiter(counts.values(), dtype=np.float64))
+            for term, counts in postings.items()
+        }
+        self.idf = {
+            term: float(np.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)))
+            for term, (docs, _) in self.postings.items()
+        }
+
+    def score(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float64)
+        if not self.avg_len:
+            return scores
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, tf = self.postings[term]
+            norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avg_len)
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1) / norm
+        return scores
+
+    # Indices of the best matching chunks, returned in document order
+    def top_k(self, query: str, k: int = TOP_K) -> List[int]:
+        scores = self.score(query)
+        if not scores.any():
+            return list(range(min(k, len(self.chunks))))
+        best = np.argsort(-scores, kind="stable")[:k]
+        return sorted(int(i) for i in best if scores[i] > 0)
+
+
+_indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+# Chunk and index attachment text once per distinct content
+def get_index(text: str) -> BM25Index:
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    index = BM25Index(chunk_text(text))
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+# Reduce attachment text to the chunks most relevant to the question
+def select_relevant_context(text: str, query: str, top_k: int = TOP_K) -> Tuple[str, Dict[str, Any]]:
+    if len(text) <= MIN_CHARS_FOR_RETRIEVAL:
+        return text, {"retrieved": False}
+    index = get_index(text)
+    selected = index.top_k(query, top_k)
+    return CHUNK_SEPARATOR.join(index.chunks[i] for i in selected), {
+        "retrieved": True,
+        "chunks": len(selected),
+        "total_chunks": len(index.chunks),
+    }
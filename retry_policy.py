@@ -0,0 +1,241 @@
+# retry_policy.py
+
+import os
+import sys
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Mapping, Optional
+
+# Retry defaults (the batch tester can override them per scenario via a "retry" block)
+MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+# Consecutive failures before a model's circuit opens, and seconds before it lets a probe through
+BREAKER_THRESHOLD = int(os.getenv("RETRY_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("RETRY_BREAKER_COOLDOWN", "60"))
+
+# Error kinds
+RATE_LIMIT = "rate_limit"
+SERVER = "server"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+PERMANENT = "permanent"
+CIRCUIT_OPEN = "circuit_open"
+
+RETRYABLE = {RATE_LIMIT, SERVER, TIMEOUT, CONNECTION}
+# Rate limits mean "slow down", not "the model is down", so they don't trip the breaker
+BREAKER_KINDS = {SERVER, TIMEOUT, CONNECTION}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Circuit open for {model}: too many recent failures, retry in {retry_in:.0f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+
+# Raised by call_with_retry when the caller's cancel_event is set before or between attempts
+class RequestCancelled(Exception):
+    pass
+
+
+# Classify a failed request by HTTP status or exception type
+def classify_error(status_code: Optional[int] = None, exception: Optional[BaseException] = None) -> str:
+    if status_code is None and exception is not None:
+        status_code = getattr(exception, "status_code", None)
+    if status_code is not None:
+        if status_code == 429:
+            return RATE_LIMIT
+        if status_code == 408 or status_code >= 500:
+            return SERVER
+        return PERMANENT
+    if isinstance(exception, CircuitOpenError):
+        return CIRCUIT_OPEN
+    name = type(exception).__name__ if exception is not None else ""
+    # requests is only checked if it was loaded; otherwise none of its exceptions can exist
+    requests = sys.modules.get("requests")
+    if (requests is not None and isinstance(exception, requests.exceptions.Timeout)) or "Timeout" in name:
+        return TIMEOUT
+    if (requests is not None and isinstance(exception, requests.exceptions.ConnectionError)) \
+            or isinstance(exception, ConnectionError) or "Connection" in name:
+        return CONNECTION
+    return PERMANENT
+
+
+# Seconds to wait according to Retry-After or rate-limit reset headers, if the server sent any
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("X-RateLimit-Reset") or headers.get("x-ratelimit-reset")
+    if reset:
+        try:
+            reset = float(reset)
+        except ValueError:
+            return None
+        # OpenRouter sends an epoch timestamp in milliseconds; others send seconds or a delta
+        if reset > 1e12:
+            reset /= 1000
+        if reset > 1e9:
+            return max(0.0, reset - time.time())
+        return reset
+    return None
+
+
+# Headers from a requests/httpx response or an OpenAI SDK exception
+def get_error_headers(response: Any = None, exception: Optional[BaseException] = None) -> Optional[Mapping[str, str]]:
+    if response is None and exception is not None:
+        response = getattr(exception, "response", None)
+    return getattr(response, "headers", None)
+
+
+# Decides whether and how long to wait before the next attempt
+class RetryPolicy:
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> "RetryPolicy":
+        config = config or {}
+        return cls(
+            max_attempts=int(config.get("max_attempts", MAX_ATTEMPTS)),
+            base_delay=float(config.get("base_delay", BASE_DELAY)),
+            max_delay=float(config.get("max_delay", MAX_DELAY))
+        )
+
+    # attempt is 1-based: the number of attempts made so far
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        return kind in RETRYABLE and attempt < self.max_attempts
+
+    # Full-jitter exponential backoff, but never sooner than the server asked for
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# Per-model circuit breaker: closed -> open after `threshold` consecutive failures -> half-open after `cooldown`
+class CircuitBreaker:
+    def __init__(self, name: str = "", threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # Whether a request may go out; in the half-open state only one probe at a time is let through
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self, kind: str) -> None:
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                if kind in BREAKER_KINDS:
+                    # The probe failed: stay open for another cooldown
+                    self.opened_at = time.monotonic()
+                else:
+                    # The model answered, just not successfully for this request
+                    self.failures = 0
+                    self.opened_at = None
+                return
+            if kind not in BREAKER_KINDS:
+                return
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                print(f"Circuit opened for {self.name} after {self.failures} consecutive failures")
+
+    # The probe ended without an outcome (the caller cancelled it): let the next request probe instead
+    def release_probe(self) -> None:
+        with self._lock:
+            self._probing = False
+
+
+# Process-wide breakers keyed by model, shared by every Streamlit session
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model)
+        return breaker
+
+
+# Call `fn` under the retry policy and the model's circuit breaker.
+# `on_retry(attempt, kind, delay)` is called before each backoff sleep.
+def call_with_retry(
+    fn: Callable[[], Any],
+    model: str,
+    policy: Optional[RetryPolicy] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    on_retry: Optional[Callable[[int, str, float], None]] = None,
+    cancel_event: Optional[threading.Event] = None
+) -> Any:
+    policy = policy or RetryPolicy()
+    breaker = breaker or get_breaker(model)
+    attempt = 0
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise RequestCancelled()
+        if not breaker.allow():
+            raise CircuitOpenError(model, breaker.retry_in())
+        attempt += 1
+        try:
+            result = fn()
+        except RequestCancelled:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            kind = classify_error(exception=e)
+            breaker.record_failure(kind)
+            if not policy.should_retry(kind, attempt):
+                raise
+            delay = policy.get_delay(attempt, parse_retry_after(get_error_headers(exception=e)))
+            if on_retry:
+                on_retry(attempt, kind, delay)
+            # Cancelling during the backoff ends the wait instead of starting another (billed) request
+            if cancel_event is not None:
+                if cancel_event.wait(delay):
+                    raise RequestCancelled()
+            else:
+                time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
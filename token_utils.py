@@ -0,0 +1,51 @@
+# token_utils.py
+
+from typing import Any, Dict, List, Tuple
+
+# Rough characters-per-token ratio used to turn token limits into text budgets
+CHARS_PER_TOKEN = 4
+# Flat per-image estimate for multimodal content parts
+IMAGE_TOKENS = 85
+# Per-message overhead for role markers and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# Fast local token estimate for plain text
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# Flatten message content (plain string or multimodal parts list) to its text
+def get_content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
+    return content or ""
+
+
+# Estimate tokens for a chat message, including image parts
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get("content", "")
+    tokens = estimate_tokens(get_content_text(content)) + MESSAGE_OVERHEAD_TOKENS
+    if isinstance(content, list):
+        tokens += IMAGE_TOKENS * sum(1 for part in content if isinstance(part, dict) and part.get("type") == "image_url")
+    return tokens
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_message_tokens(m) for m in messages)
+
+
+# Per-token USD prices from catalog pricing (OpenRouter sends "prompt"/"completion" as strings)
+def get_token_prices(model_meta: Dict[str, Any]) -> Tuple[float, float]:
+    pricing = (model_meta or {}).get("pricing") or {}
+    try:
+        return float(pricing.get("prompt") or 0), float(pricing.get("completion") or 0)
+    except (TypeError, ValueError):
+        return 0.0, 0.0
+
+
+def estimate_cost(model_meta: Dict[str, Any], prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = get_token_prices(model_meta)
+    return prompt_tokens * prompt_price + completion_tokens * completion_price
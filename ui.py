@@ -8,18 +8,34 @@ try:
     import traceback
     from utils import (
         calculate_token_stats,
+        build_turn_usage,
+        add_turn_usage,
         parse_uploaded_files,
+        describe_image_savings,
+        get_attachment_char_budget,
         init_openai,
         fetch_available_models
     )
     from chat_utils import (
-        get_chat_dates,
-        load_chat_by_date,
+        list_chats,
+        load_chat_window,
+        load_chat_slice,
         delete_chat_by_date,
         save_chat_history,
-        clear_all_chats
+        clear_all_chats,
+        search_chat_history
     )
     from custom_style import inject_chat_input_style
+    from user_space import get_current_user, get_user_config_store
+    from context_packer import pack_messages, describe_pack_report, TRIM_POLICIES
+    from model_catalog import get_cached_catalog
+    from token_utils import estimate_tokens, estimate_cost, get_token_prices, IMAGE_TOKENS
+    from job_runner import job_runner, JOB_RUNNING, JOB_ERROR, JOB_CANCELLED
+    from response_cache import (
+        response_cache,
+        CACHE_ENABLED as RESPONSE_CACHE_ENABLED,
+        CACHE_FORCE as RESPONSE_CACHE_FORCE
+    )
 except ImportError as e:
     st.error(f"Failed to import a module: {e}")
 
@@ -30,6 +46,14 @@ OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/ap
 # Key used to track the last selected model in session state
 LAST_MODEL_KEY = "__last_model_for_switch_check__"
 
+# Seconds between progress polls of a background generation
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# Messages rendered per page; "Load earlier messages" extends the window by one page
+RENDER_PAGE_SIZE = int(os.getenv("RENDER_PAGE_SIZE", "20"))
+# Saved messages kept in session state; older turns are read back from the chat file on demand
+SESSION_MESSAGE_LIMIT = int(os.getenv("SESSION_MESSAGE_LIMIT", "100"))
+
 # Added type hints and error handling for initialize_session_state
 def initialize_session_state(defaults: dict) -> None:
     if not isinstance(defaults, dict):
@@ -38,6 +62,42 @@ def initialize_session_state(defaults: dict) -> None:
         if key not in st.session_state:
             st.session_state[key] = value
 
+# Catalog metadata for a model, from the session or the shared catalog cache
+def get_model_meta(model: str) -> dict:
+    model_info = st.session_state.get("model_info") or (get_cached_catalog() or {}).get("model_info", {})
+    return model_info.get(model, {})
+
+# Saved turns before the ones held in session state (trimmed by trim_session_messages or never loaded)
+def load_earlier_messages(chat_id: str, offset: int) -> list:
+    return load_chat_slice(chat_id, 0, offset) if chat_id and offset else []
+
+# The whole conversation: earlier turns read back from the chat file, then the in-session ones
+def get_full_conversation() -> list:
+    return load_earlier_messages(st.session_state.get("chat_id"), st.session_state.get("history_offset", 0)) + st.session_state.messages
+
+# Replace the conversation held in session state, reset paging and recompute token totals once
+def set_conversation(messages: list = None, chat_id: str = None, offset: int = 0) -> None:
+    messages = messages or []
+    cancel_pending_job()
+    st.session_state.update({
+        "messages": messages,
+        "chat_id": chat_id,
+        "history_offset": offset,
+        "render_window": RENDER_PAGE_SIZE,
+        "pinned_positions": set(),
+        # Totals cover the whole chat, not just the turns held in memory
+        "token_stats": calculate_token_stats(
+            load_earlier_messages(chat_id, offset) + messages, get_model_meta(st.session_state.get("selected_model", ""))
+        )
+    })
+
+# Drop already-saved turns beyond SESSION_MESSAGE_LIMIT from session memory
+def trim_session_messages() -> None:
+    excess = len(st.session_state.messages) - SESSION_MESSAGE_LIMIT
+    if excess > 0 and st.session_state.get("chat_id"):
+        st.session_state.messages = st.session_state.messages[excess:]
+        st.session_state.history_offset = st.session_state.get("history_offset", 0) + excess
+
 # Added type hints and optimized rerun logic in handle_model_switch
 def handle_model_switch(selected: str, models: list, multimodal: list) -> None:
     if LAST_MODEL_KEY not in st.session_state:
@@ -55,11 +115,9 @@ def handle_model_switch(selected: str, models: list, multimodal: list) -> None:
                     "max_tokens": st.session_state.max_tokens,
                 },
                 "system_prompt": st.session_state.custom_system_prompt
-            }] + st.session_state.messages)
-        st.session_state.update({
-            LAST_MODEL_KEY: selected,
-            "messages": []
-        })
+            }] + st.session_state.messages, st.session_state.get("chat_id"), st.session_state.get("history_offset", 0))
+        st.session_state[LAST_MODEL_KEY] = selected
+        set_conversation()
         st.rerun()
 
     st.session_state.selected_model = selected
@@ -74,39 +132,72 @@ def render_model_info(selected, model_info, multimodal):
         st.session_state.max_tokens = context_limit
 
     with st.expander("Model Info & Pricing"):
-        st.markdown(f"- Prompt: {pricing.get('prompt', 'nd')} $/1M tokens")
-        st.markdown(f"- Completion: {pricing.get('completion', 'nd')} $/1M tokens")
+        # Catalog prices are USD per token
+        prompt_price, completion_price = get_token_prices(meta)
+        st.markdown(f"- Prompt: {prompt_price * 1_000_000:.2f} $/1M tokens")
+        st.markdown(f"- Completion: {completion_price * 1_000_000:.2f} $/1M tokens")
         st.markdown(f"- Image: {pricing.get('image', 'nd')} $/image")
         st.markdown(f"- Context: {context_limit} tokens")
 
     is_multimodal = meta.get("architecture", {}).get("modality", "").startswith("text+image")
     st.markdown(f"**Multimodal:** {'✅ Yes' if is_multimodal else '❌ No'}")
 
+# Open a saved chat so that message `position` falls inside the rendered window
+def open_chat_at(chat_id, position=None):
+    _, messages, offset = load_chat_window(chat_id, SESSION_MESSAGE_LIMIT)
+    set_conversation(messages, chat_id, offset)
+    if position is not None:
+        st.session_state.render_window = max(RENDER_PAGE_SIZE, offset + len(messages) - position)
+
+# Full-text search box with ranked snippets; each hit opens its chat
+def render_chat_search():
+    query = st.text_input("🔎 Search chats", key="chat_search_query", placeholder="Words from any message")
+    if not query.strip():
+        return
+    hits = search_chat_history(query)
+    if not hits:
+        st.caption("No matching messages.")
+        return
+    for hit in hits:
+        chat = hit["chat"]
+        st.markdown(f"**{chat['title'] or chat['date']}** · {chat['date']} · {hit['role']}")
+        st.markdown(hit["snippet"])
+        if st.button("Open", key=f"open_hit_{hit['chat_id']}_{hit['position']}"):
+            open_chat_at(hit["chat_id"], hit["position"])
+            st.rerun()
+
 def render_chat_history():
     st.markdown("### 💬 Chat History")
-    chat_dates = get_chat_dates()
+    render_chat_search()
+    chats = {entry["date"]: entry for entry in list_chats()}
 
-    if chat_dates:
+    if chats:
         selected_date = st.selectbox(
             "Select a chat session:",
-            options=[f"{date} ({load_chat_by_date(date)[0].get('model', 'unknown')})" for date in chat_dates],
+            options=list(chats),
+            format_func=lambda date: (
+                f"{date} ({chats[date]['model']}, {chats[date]['message_count']} msgs)"
+                + (f" — {chats[date]['title']}" if chats[date]["title"] else "")
+            ),
             key="chat_history_selector"
         )
 
         if st.button("Load Selected Chat"):
-            selected_date_only = selected_date.split(" (")[0]
-            st.session_state.messages = load_chat_by_date(selected_date_only)[1:]
+            open_chat_at(selected_date)
             st.rerun()
 
         if st.button("Delete Selected Chat"):
-            selected_date_only = selected_date.split(" (")[0]
-            delete_chat_by_date(selected_date_only)
+            delete_chat_by_date(selected_date)
+            if st.session_state.get("chat_id") == selected_date:
+                set_conversation(st.session_state.messages)
             st.rerun()
     else:
         st.markdown("No chat history available.")
 
 def render_left_panel(api_key, models, multimodal, model_info, config):
     st.markdown("### Settings")
+    if get_current_user():
+        st.caption(f"👤 {get_current_user()}")
     st.session_state.api_key = st.text_input("API Key", type="password", value=api_key)
 
     st.markdown("### Model Selection")
@@ -120,13 +211,37 @@ def render_left_panel(api_key, models, multimodal, model_info, config):
 
     handle_model_switch(selected, models, multimodal)
     st.markdown(f"#### Active: {selected}")
+    st.session_state.compare_models = st.multiselect(
+        "Compare with",
+        [m for m in all_models if m != selected],
+        default=[m for m in st.session_state.get("compare_models", []) if m in all_models and m != selected],
+        help="Also send each prompt to these models, concurrently, and show the answers side by side"
+    )
 
     render_model_info(selected, model_info, multimodal)
 
     st.session_state.input_height = st.slider("Chat Input Height", 60, 300, st.session_state.input_height)
+    st.session_state.stream_responses = st.checkbox("Stream responses", value=st.session_state.get("stream_responses", True))
+    policies = list(TRIM_POLICIES)
+    st.session_state.context_policy = st.selectbox(
+        "Context trimming",
+        policies,
+        index=policies.index(st.session_state.get("context_policy", "drop-oldest")),
+        help="How older turns are handled when the conversation exceeds the model's context window"
+    )
+    st.session_state.use_response_cache = st.checkbox(
+        "Cache identical requests",
+        value=st.session_state.get("use_response_cache", RESPONSE_CACHE_ENABLED),
+        help="Reuse stored answers for identical requests. Only applies at temperature 0 unless forced."
+    )
+    if st.session_state.use_response_cache:
+        st.session_state.force_response_cache = st.checkbox(
+            "Also cache non-deterministic requests",
+            value=st.session_state.get("force_response_cache", RESPONSE_CACHE_FORCE)
+        )
 
     if st.button("➕ New Chat"):
-        st.session_state.messages = []
+        set_conversation()
         st.session_state.attached_text = ""
         st.rerun()
 
@@ -135,28 +250,264 @@ def render_left_panel(api_key, models, multimodal, model_info, config):
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Background job runner shared by all sessions; a session only remembers its pending job's id
+def get_job_runner():
+    return job_runner
+
+# Stop the in-flight generation(s), if any, and forget them
+def cancel_pending_job():
+    pending = st.session_state.get("pending_job")
+    if not pending:
+        return
+    runner = get_job_runner()
+    for entry in pending["jobs"]:
+        job = runner.get(entry["id"])
+        if job is not None:
+            job.cancel()
+            runner.discard(job.id)
+    st.session_state.pending_job = None
+
+# Start one completion per request in worker threads (several in compare mode); the script returns
+# immediately and polls them on later runs
+def start_completion_jobs(client, params_list):
+    use_cache = st.session_state.get("use_response_cache", RESPONSE_CACHE_ENABLED)
+    force_cache = st.session_state.get("force_response_cache", RESPONSE_CACHE_FORCE)
+    runner = get_job_runner()
+    jobs = [runner.submit(client, params, {"force": force_cache, "bypass": not use_cache}) for params in params_list]
+    st.session_state.pending_job = {
+        "jobs": [
+            {"id": job.id, "model": params["model"], "messages": params["messages"]}
+            for job, params in zip(jobs, params_list)
+        ]
+    }
+
+# Jobs of the pending turn that are still known to the runner
+def get_pending_jobs():
+    pending = st.session_state.get("pending_job")
+    if not pending:
+        return []
+    runner = get_job_runner()
+    return [job for job in (runner.get(entry["id"]) for entry in pending["jobs"]) if job is not None]
+
+# One model's answer of a finished turn; usage is booked only for answers with output
+def collect_answer(entry, job):
+    if job is None:
+        return {"model": entry["model"], "error": "The answer was lost"}
+    if job.status == JOB_ERROR:
+        return {"model": entry["model"], "error": job.error}
+    result = job.result
+    if job.status == JOB_CANCELLED and not result["content"]:
+        return {"model": entry["model"], "error": "Stopped before the model answered", "cancelled": True}
+    model_meta = get_model_meta(entry["model"])
+    usage = build_turn_usage(result["usage"], entry["messages"], result["content"], model_meta)
+    add_turn_usage(get_token_stats(), usage, model_meta)
+    answer = {"model": entry["model"], **result, "usage": usage}
+    if job.status == JOB_CANCELLED:
+        answer["cancelled"] = True
+    return answer
+
+# Move a finished turn's answer into the conversation. Returns True when a message was added.
+def finalize_pending_job():
+    pending = st.session_state.get("pending_job")
+    if not pending:
+        return False
+    runner = get_job_runner()
+    jobs = [(entry, runner.get(entry["id"])) for entry in pending["jobs"]]
+    if any(job is not None and job.poll() == JOB_RUNNING for _, job in jobs):
+        return False
+    for _, job in jobs:
+        if job is not None:
+            runner.discard(job.id)
+    st.session_state.pending_job = None
+
+    answers = [collect_answer(entry, job) for entry, job in jobs]
+    succeeded = [answer for answer in answers if not answer.get("error")]
+    if not succeeded:
+        # Nothing to add: an empty assistant turn would be resent with every later request
+        for answer in answers:
+            if answer.get("cancelled"):
+                st.info("⏹ Stopped before the model answered; nothing was added to the chat")
+            else:
+                st.error(f"Err: {answer['model']}: {answer['error']}" if len(answers) > 1 else f"Err: {answer['error']}")
+        return False
+
+    # The selected model's answer (or the first successful one) continues the conversation
+    primary = succeeded[0]
+    generation_time = primary["total_time"] - primary["ttft"]
+    st.session_state.last_turn_stats = {
+        "ttft": primary["ttft"],
+        "total_time": primary["total_time"],
+        "completion_tokens": primary["usage"]["completion_tokens"],
+        "tokens_per_sec": primary["usage"]["completion_tokens"] / generation_time if generation_time > 0 else 0.0,
+        "cached": primary.get("cached", False)
+    }
+    message = {"role": "assistant", "content": primary["content"], "usage": primary["usage"]}
+    if primary.get("cancelled"):
+        message["cancelled"] = True
+    if len(answers) > 1:
+        message["compare"] = answers
+    st.session_state.messages.append(message)
+    return True
+
+def render_job_progress(job, status):
+    if status == JOB_ERROR:
+        st.error(job.error)
+        return
+    if job.notice:
+        st.info(f"⏳ {job.notice}")
+    if st.session_state.get("stream_responses", True) and job.text:
+        st.markdown(job.text + ("▌" if status == JOB_RUNNING else ""), unsafe_allow_html=True)
+    else:
+        st.caption(f"⏳ Generating… {job.elapsed:.0f}s")
+
+# Live view of the in-flight generation(s), side by side in compare mode. Reruns on its own every
+# JOB_POLL_INTERVAL seconds without touching the rest of the page; a full rerun picks up the answers.
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_pending_job():
+    jobs = get_pending_jobs()
+    if not jobs:
+        return
+    statuses = [job.poll() for job in jobs]
+    with st.chat_message("assistant"):
+        if len(jobs) == 1:
+            render_job_progress(jobs[0], statuses[0])
+        else:
+            for column, job, status in zip(st.columns(len(jobs)), jobs, statuses):
+                with column:
+                    st.markdown(f"**{job.model}**")
+                    render_job_progress(job, status)
+        if JOB_RUNNING not in statuses:
+            st.rerun()
+        if st.button("⏹ Stop generating", key=f"stop_{jobs[0].id}"):
+            for job in jobs:
+                job.cancel()
+
+# Pack the conversation into the model's context window and build the completion request.
+# Turns trimmed from session memory are read back from the chat file: the packer decides what fits
+# and reports what it dropped.
+def build_request_params(model, model_meta, system_prompt):
+    pinned = st.session_state.get("pinned_positions", set())
+    msgs, pack_report = pack_messages(
+        system_prompt,
+        [
+            {"role": m["role"], "content": m["content"], **({"pinned": True} if position in pinned else {})}
+            for position, m in enumerate(get_full_conversation())
+        ],
+        context_length=model_meta.get("context_length", 4096),
+        max_tokens=st.session_state.max_tokens,
+        policy=st.session_state.get("context_policy", "drop-oldest")
+    )
+    params = dict(
+        model=model,
+        messages=msgs,
+        temperature=st.session_state.temperature,
+        max_tokens=st.session_state.max_tokens,
+        top_p=st.session_state.top_p,
+        presence_penalty=st.session_state.presence_penalty,
+        frequency_penalty=st.session_state.frequency_penalty,
+        # Ask OpenRouter to report the billed cost in the usage block
+        extra_body={"usage": {"include": True}}
+    )
+    return params, pack_report
+
+def get_token_stats():
+    if "token_stats" not in st.session_state:
+        st.session_state.token_stats = calculate_token_stats(
+            get_full_conversation(), get_model_meta(st.session_state.get("selected_model", ""))
+        )
+    return st.session_state.token_stats
+
+def format_answer_stats(answer):
+    usage = answer.get("usage") or {}
+    if answer.get("cached"):
+        return "⚡ from response cache"
+    return (
+        f"⏱ TTFT {answer['ttft']:.2f}s · total {answer['total_time']:.2f}s · "
+        f"{usage.get('completion_tokens', 0)} tok · ${usage.get('cost', 0.0):.6f}"
+    )
+
+# Side-by-side answers of a compare-mode turn
+def render_compare_answers(answers):
+    for column, answer in zip(st.columns(len(answers)), answers):
+        with column:
+            st.markdown(f"**{answer['model']}**")
+            if answer.get("cancelled") and answer.get("error"):
+                st.caption(f"⏹ {answer['error']}")
+                continue
+            if answer.get("error"):
+                st.error(answer["error"])
+                continue
+            st.markdown(answer["content"], unsafe_allow_html=True)
+            st.caption(format_answer_stats(answer))
+            if answer.get("cancelled"):
+                st.caption("⏹ Stopped before completion")
+
+# Pinned messages are kept first when the keep-pinned policy trims the conversation.
+# Pins are positions in the whole chat, so they survive the message being trimmed from session memory.
+def render_pin_toggle(position):
+    pinned = st.session_state.setdefault("pinned_positions", set())
+    label = "📌 Unpin" if position in pinned else "📌 Pin"
+    if st.button(label, key=f"pin_{position}", help="Keep this message when older turns are trimmed"):
+        pinned.symmetric_difference_update({position})
+        st.rerun()
+
+# Render only the newest `render_window` messages (newest first), paging older ones in from the chat file
+def render_message_window():
+    messages = st.session_state.messages
+    window = st.session_state.get("render_window", RENDER_PAGE_SIZE)
+    offset = st.session_state.get("history_offset", 0)
+    chat_id = st.session_state.get("chat_id")
+
+    visible = messages[-window:]
+    if window > len(messages) and offset and chat_id:
+        start = max(0, offset - (window - len(messages)))
+        visible = load_chat_slice(chat_id, start, offset) + visible
+    hidden = offset + len(messages) - len(visible)
+    show_pins = st.session_state.get("context_policy") == "keep-pinned"
+
+    for i in reversed(range(len(visible))):
+        m = visible[i]
+        with st.chat_message(m["role"]):
+            if m.get("compare"):
+                render_compare_answers(m["compare"])
+            else:
+                st.markdown(m["content"], unsafe_allow_html=True)
+                if m.get("cancelled"):
+                    st.caption("⏹ Stopped before completion")
+            if show_pins:
+                render_pin_toggle(hidden + i)
+
+    if hidden > 0:
+        # Static label: the hidden count changes between reruns and would reset the button
+        if st.button("⬆️ Load earlier messages", key="load_earlier_messages"):
+            st.session_state.render_window = window + RENDER_PAGE_SIZE
+            st.rerun()
+        st.caption(f"{hidden} earlier message(s) not shown")
+
 def render_chat_center(model_info, multimodal_models):
     inject_chat_input_style()
     updated = False
     mdl = st.session_state.get("selected_model", "")
 
-    for m in reversed(st.session_state.messages):
-        with st.chat_message(m["role"]):
-            st.markdown(m["content"], unsafe_allow_html=True)
+    updated = finalize_pending_job()
+    render_message_window()
 
     st.markdown("<div id='end_of_chat'></div>", unsafe_allow_html=True)
 
     if "uploaded_files" not in st.session_state:
         st.session_state.uploaded_files = []
 
-    file_context, img64_list = parse_uploaded_files(st.session_state.uploaded_files)
+    char_budget = get_attachment_char_budget(model_info.get(mdl, {}), st.session_state.max_tokens)
+    file_context, images = parse_uploaded_files(st.session_state.uploaded_files, char_budget=char_budget)
+    # Local estimate for attachments that haven't been sent yet (sent turns use API-reported usage)
+    st.session_state.draft_tokens = estimate_tokens(file_context) + IMAGE_TOKENS * len(images)
 
     st.markdown('<div id="chat_input_box">', unsafe_allow_html=True)
     with st.form("chat_form", clear_on_submit=True):
         prompt = st.text_area("Type your message...", key="chat_input", label_visibility="collapsed", height=st.session_state.input_height)
         files = st.file_uploader(
             "Drag and drop files here or click to upload",
-            type=["png", "jpg", "jpeg", "pdf", "docx", "txt"],
+            type=["png", "jpg", "jpeg", "webp", "pdf", "docx", "txt"],
             accept_multiple_files=True,
             label_visibility="collapsed"
         )
@@ -168,19 +519,27 @@ def render_chat_center(model_info, multimodal_models):
         submitted = st.form_submit_button("Send")
     st.markdown('</div>', unsafe_allow_html=True)
 
-    if submitted and prompt.strip():
+    if submitted and prompt.strip() and st.session_state.get("pending_job"):
+        st.warning("Wait for the current answer to finish or stop it first")
+    elif submitted and prompt.strip():
         if not mdl:
             st.warning("Select a model first")
             return False
 
         multimodal = model_info.get(mdl, {}).get("multimodal", False) or mdl in multimodal_models
-        file_context = file_context.strip()
-
-        if multimodal and img64_list:
+        # Large attachments contribute only the chunks relevant to this question.
+        # Imported here: retrieval pulls in NumPy, which the first paint doesn't need.
+        from retrieval import select_relevant_context
+        file_context, retrieval_info = select_relevant_context(file_context.strip(), prompt)
+        if retrieval_info["retrieved"]:
+            st.caption(f"📎 Using {retrieval_info['chunks']} of {retrieval_info['total_chunks']} attachment chunks relevant to your question")
+
+        if multimodal and images:
             content = [{"type": "text", "text": prompt + (f"\n\n[File Context]:\n{file_context}" if file_context else "")}]
-            content += [{"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img}"}} for img in img64_list]
+            content += [{"type": "image_url", "image_url": {"url": f"data:{img['mime']};base64,{img['data']}"}} for img in images]
+            st.caption(f"🖼️ {describe_image_savings(images)}")
         else:
-            if img64_list:
+            if images:
                 st.warning("Selected model doesn't support images. Only text will be sent.")
             content = prompt + (f"\n\n[File Context]:\n{file_context}" if file_context else "")
 
@@ -200,26 +559,30 @@ def render_chat_center(model_info, multimodal_models):
         with st.chat_message("user"):
             st.markdown(prompt, unsafe_allow_html=True)
 
-        with st.chat_message("assistant"):
-            placeholder = st.empty()
-            try:
-                msgs = [system_prompt] + [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-                completion = client.chat.completions.create(
-                    model=mdl,
-                    messages=msgs,
-                    temperature=st.session_state.temperature,
-                    max_tokens=st.session_state.max_tokens,
-                    top_p=st.session_state.top_p,
-                    presence_penalty=st.session_state.presence_penalty,
-                    frequency_penalty=st.session_state.frequency_penalty
-                )
-                result = completion.choices[0].message.content
-                placeholder.markdown(result, unsafe_allow_html=True)
-                st.session_state.messages.append({"role": "assistant", "content": result})
-                updated = True
-            except Exception as e:
-                st.error(f"Err: {e}")
-                st.code(traceback.format_exc())
+        compare_models = [m for m in st.session_state.get("compare_models", []) if m != mdl and m in model_info]
+        try:
+            if compare_models:
+                # One background job per model; the answers stream side by side in render_pending_job
+                start_completion_jobs(client, [
+                    build_request_params(model, model_info.get(model, {}), system_prompt["content"])[0]
+                    for model in [mdl] + compare_models
+                ])
+            else:
+                params, pack_report = build_request_params(mdl, model_info.get(mdl, {}), system_prompt["content"])
+                st.session_state.last_pack_report = pack_report
+                if pack_report["over_budget_tokens"]:
+                    st.warning(f"⚠️ The request is {pack_report['over_budget_tokens']} tokens over the model's context budget; shorten the system prompt or lower Max tokens.")
+                if describe_pack_report(pack_report):
+                    with st.expander(f"✂️ Context trimmed: {describe_pack_report(pack_report)}"):
+                        for dropped in pack_report["dropped"]:
+                            st.markdown(f"- **{dropped['role']}**: {dropped['preview']}")
+                start_completion_jobs(client, [params])
+        except Exception as e:
+            st.error(f"Err: {e}")
+            st.code(traceback.format_exc())
+
+    if st.session_state.get("pending_job"):
+        render_pending_job()
 
     st.components.v1.html("""
         <script>
@@ -250,15 +613,32 @@ def render_right_panel(model_info):
         context_limit = meta.get("context_length", 4096)
         fixed_settings = meta.get("fixed_params", {})
 
-        stats = calculate_token_stats(st.session_state.messages, meta)
+        # Running totals, updated once per turn from API-reported usage
+        stats = get_token_stats()
 
         st.markdown(f"**Input tokens:** {stats['input_tokens']}")
         st.markdown(f"**Output tokens:** {stats['output_tokens']}")
         st.markdown(f"**Total tokens:** {stats['total_tokens']}")
         st.markdown("---")
-        st.markdown(f"**Input cost:** ${stats['input_cost']}")
-        st.markdown(f"**Output cost:** ${stats['output_cost']}")
-        st.markdown(f"**Total cost:** **${stats['total_cost']}**")
+        st.markdown(f"**Input cost:** ${stats['input_cost']:.6f}")
+        st.markdown(f"**Output cost:** ${stats['output_cost']:.6f}")
+        st.markdown(f"**Total cost:** **${stats['total_cost']:.6f}**")
+
+        draft_tokens = st.session_state.get("draft_tokens", 0)
+        if draft_tokens:
+            st.markdown(f"**Pending attachments:** ~{draft_tokens} tokens (~${estimate_cost(meta, draft_tokens, 0):.6f}, estimate)")
+
+        turn_stats = st.session_state.get("last_turn_stats")
+        if turn_stats:
+            st.markdown("---")
+            st.markdown(f"**Time to first token:** {turn_stats['ttft']:.2f}s")
+            st.markdown(f"**Generation speed:** {turn_stats['tokens_per_sec']:.1f} tok/s")
+            if turn_stats.get("cached"):
+                st.markdown("**Served from response cache**")
+
+        if st.session_state.get("use_response_cache"):
+            cache_stats = response_cache.stats()
+            st.markdown(f"**Response cache:** {cache_stats['hits']} hits / {cache_stats['misses']} misses")
 
         def slider_or_fixed(label, key, min_val, max_val, step, default):
             fixed = fixed_settings.get(key)
@@ -286,22 +666,20 @@ def render_right_panel(model_info):
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🔁 Refresh models"):
-                models, multimodal, model_info = fetch_available_models(st.session_state.api_key)
+                models, multimodal, model_info = fetch_available_models(st.session_state.api_key, force_refresh=True)
                 st.session_state.saved_models = models
                 st.session_state.saved_multimodal = multimodal
                 st.session_state.model_info = model_info
                 st.rerun()
         with col2:
             if st.button("🧹 Reset config"):
-                import os
-                if os.path.exists("config.json"):
-                    os.remove("config.json")
+                get_user_config_store().reset()
                 st.rerun()
 
         st.markdown("---")
         if st.button("🗑️ Clear Chat History"):
             clear_all_chats()
-            st.session_state.messages = []
+            set_conversation()
             st.session_state.attached_text = ""
             st.rerun()
 
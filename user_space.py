@@ -0,0 +1,77 @@
+# user_space.py
+
+import os
+import re
+import hashlib
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from config_store import CONFIG_FILE, ConfigStore, get_config_store
+
+# Per-user settings and chats live under USER_DATA_DIR/<user id>/
+USER_DATA_DIR = os.getenv("USER_DATA_DIR", "users")
+# Request header carrying the user name when an auth proxy sits in front of the app (e.g. X-Forwarded-User)
+USER_HEADER = os.getenv("USER_HEADER", "")
+# Fallback for deployments without login: ?user=<name> in the URL
+USER_QUERY_PARAM = "user"
+# Local single-user mode keeps the original layout (config.json and chat_history/ in the working directory)
+DEFAULT_USER = ""
+MAX_USER_ID_LENGTH = 64
+
+
+# Filesystem-safe user id; names that had to be changed get a hash suffix so they can't collide
+def sanitize_user_id(raw: str) -> str:
+    raw = (raw or "").strip()
+    if not raw:
+        return DEFAULT_USER
+    safe = re.sub(r"[^a-z0-9._@-]", "_", raw.lower())[:MAX_USER_ID_LENGTH].strip(".")
+    if safe != raw:
+        safe = f"{safe}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:8]}"
+    return safe
+
+
+# Who is using this session: Streamlit login, then the proxy header, then the URL parameter
+def resolve_user_id() -> str:
+    try:
+        user = getattr(st, "user", None) or st.experimental_user
+        if user.get("is_logged_in") and user.get("email"):
+            return sanitize_user_id(user["email"])
+    except Exception:
+        pass
+    try:
+        if USER_HEADER and st.context.headers.get(USER_HEADER):
+            return sanitize_user_id(st.context.headers[USER_HEADER])
+        return sanitize_user_id(st.query_params.get(USER_QUERY_PARAM, ""))
+    except Exception:
+        return DEFAULT_USER
+
+
+# User of the current session, resolved once. Code running outside a script run is the default user.
+def get_current_user() -> str:
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return DEFAULT_USER
+    try:
+        if "user_id" not in st.session_state:
+            st.session_state.user_id = resolve_user_id()
+        return st.session_state.user_id
+    except Exception:
+        return DEFAULT_USER
+
+
+def get_user_dir(user_id: str) -> str:
+    return os.path.join(USER_DATA_DIR, user_id) if user_id else "."
+
+
+# Where a user's copy of a shared path lives; the default user keeps the path as is
+def get_user_chat_dir(user_id: str, chat_dir: str) -> str:
+    return os.path.join(get_user_dir(user_id), chat_dir) if user_id else chat_dir
+
+
+def get_user_config_path(user_id: str, config_file: str) -> str:
+    return os.path.join(get_user_dir(user_id), config_file) if user_id else config_file
+
+
+# Settings store of the current session's user
+def get_user_config_store() -> ConfigStore:
+    return get_config_store(get_user_config_path(get_current_user(), CONFIG_FILE))